@@ -1,5 +1,5 @@
 import streamlit as st
-from utils import run_agent_sync, concatenate_messages, sanitize_learning_path_text, extract_days_and_questions, save_history_record, load_history, export_to_pdf, upload_pdf_to_drive_via_agent, load_progress, save_progress
+from utils import start_generation, stream_learning_path, concatenate_messages, sanitize_learning_path_text, extract_days_and_questions, save_history_record, load_history, export_to_pdf, upload_pdf_to_drive_via_agent, load_progress, save_progress, learning_path_to_day_items, RunBudget, get_tool_compaction_stats, CircuitOpenError, ResumableGenerationError, prefetch_agent
 import os
 
 st.set_page_config(page_title="MCP POC", page_icon="🤖", layout="wide")
@@ -15,10 +15,31 @@ if 'last_section' not in st.session_state:
     st.session_state.last_section = ""
 if 'is_generating' not in st.session_state:
     st.session_state.is_generating = False
+if st.session_state.pop('generation_cancelled', False):
+    st.info("Generation cancelled.")
 
 # Sidebar for API and URL configuration
 st.sidebar.header("Configuration")
 debug_mode = st.sidebar.checkbox("Debug mode", value=False, help="Show detailed error tracebacks")
+stream_output = st.sidebar.checkbox("Stream output", value=True, help="Show the learning path as it is being written")
+generation_mode_label = st.sidebar.radio(
+    "Generation mode:",
+    ["Agent (ReAct)", "Fast (plan + parallel search)", "Structured (JSON)", "Direct (no tools)"],
+    help="Fast mode plans all days in one call, then searches videos and writes questions for every day in parallel. "
+         "Structured mode asks the agent for a schema-validated JSON learning path. "
+         "Direct mode makes a single model call without YouTube/Drive/Notion tools."
+)
+max_run_tokens = st.sidebar.number_input(
+    "Token budget per run (0 = unlimited)", min_value=0, value=0, step=10000,
+    help="Stop the agent cleanly once a generation has used this many tokens"
+)
+run_budget = RunBudget(max_total_tokens=int(max_run_tokens)) if max_run_tokens else None
+generation_mode = {
+    "Agent (ReAct)": "agent",
+    "Fast (plan + parallel search)": "fanout",
+    "Structured (JSON)": "structured",
+    "Direct (no tools)": "direct",
+}[generation_mode_label]
 
 # API Key input (prefill if provided by user)
 default_google_key = ""
@@ -48,6 +69,10 @@ else:
     notion_pipedream_url = (_notion_input or "").strip()
     drive_pipedream_url = None
 
+# Connect to the MCP servers and build the agent in the background while the goal is typed
+if not st.session_state.is_generating:
+    prefetch_agent(google_api_key, youtube_pipedream_url, drive_pipedream_url, notion_pipedream_url, mode=generation_mode)
+
 # Quick guide before goal input
 st.info("""
 **Quick Guide:**
@@ -84,6 +109,9 @@ def update_progress(message: str):
     elif "Generating your learning path" in message:
         section = "Generation"
         st.session_state.progress = 0.5
+    elif message.startswith("Calling tool") or (message.startswith("Day ") and " ready: " in message):
+        section = "Generation"
+        st.session_state.progress = min(0.9, st.session_state.progress + 0.02)
     elif "Learning path generation complete" in message:
         section = "Complete"
         st.session_state.progress = 1.0
@@ -110,9 +138,19 @@ def update_progress(message: str):
             st.write(f"{prefix} {message}")
 
 col_gen, col_pdf = st.columns([2,1])
+cancel_slot = col_gen.empty()
+
+# A failed checkpointed run for the current goal can be continued instead of restarted
+resume_run = st.session_state.get("resume_run")
+if resume_run and resume_run.get("goal") != user_goal:
+    resume_run = None
+resume_clicked = bool(resume_run) and col_gen.button(
+    "Resume Failed Generation", disabled=st.session_state.is_generating,
+    help="Continue the last failed generation from its last completed step"
+)
 
 # Generate Learning Path button
-if col_gen.button("Generate Learning Path", type="primary", disabled=st.session_state.is_generating):
+if col_gen.button("Generate Learning Path", type="primary", disabled=st.session_state.is_generating) or resume_clicked:
     if not google_api_key:
         st.error("Please enter your Google API key in the sidebar.")
     elif not youtube_pipedream_url:
@@ -136,18 +174,91 @@ if col_gen.button("Generate Learning Path", type="primary", disabled=st.session_
             st.session_state.current_step = ""
             st.session_state.progress = 0
             st.session_state.last_section = ""
+            resume_thread_id = resume_run["thread_id"] if resume_clicked else None
+            run_mode = resume_run["mode"] if resume_clicked else generation_mode
             
-            result = run_agent_sync(
-                google_api_key=google_api_key,
-                youtube_pipedream_url=youtube_pipedream_url,
-                drive_pipedream_url=drive_pipedream_url,
-                notion_pipedream_url=notion_pipedream_url,
-                user_goal=user_goal,
-                progress_callback=update_progress
+            # Clicking Cancel reruns the script; Streamlit then interrupts this run at its next
+            # UI update and the finally blocks below cancel the generation
+            cancel_slot.button(
+                "Cancel Generation", key="cancel_generation",
+                on_click=lambda: st.session_state.update(generation_cancelled=True)
             )
             
+            if stream_output and run_mode == "agent" and not resume_thread_id:
+                # Render text deltas as they arrive; the final event carries the full result
+                stream_box = st.empty()
+                streamed_text = ""
+                result = None
+                events = stream_learning_path(
+                    google_api_key=google_api_key,
+                    youtube_pipedream_url=youtube_pipedream_url,
+                    drive_pipedream_url=drive_pipedream_url,
+                    notion_pipedream_url=notion_pipedream_url,
+                    user_goal=user_goal,
+                    progress_callback=update_progress,
+                    budget=run_budget,
+                    # Touches the UI between events so a Cancel click can interrupt the stream
+                    heartbeat=lambda: progress_bar.progress(st.session_state.progress)
+                )
+                try:
+                    for event in events:
+                        if event["type"] == "token":
+                            streamed_text += event["text"]
+                            stream_box.markdown(streamed_text)
+                        elif event["type"] == "tool_start":
+                            update_progress(f"Calling tool {event['name']}...")
+                        elif event["type"] == "done":
+                            result = event["result"]
+                finally:
+                    # Closing the stream cancels the run if it is still going
+                    events.close()
+                stream_box.empty()
+            else:
+                run = start_generation(
+                    google_api_key=google_api_key,
+                    youtube_pipedream_url=youtube_pipedream_url,
+                    drive_pipedream_url=drive_pipedream_url,
+                    notion_pipedream_url=notion_pipedream_url,
+                    user_goal=user_goal,
+                    mode=run_mode,
+                    budget=run_budget,
+                    thread_id=resume_thread_id
+                )
+                try:
+                    # The heartbeat touches the UI so a Cancel click can interrupt the wait
+                    result = run.wait(
+                        update_progress,
+                        heartbeat=lambda: progress_bar.progress(st.session_state.progress)
+                    )
+                finally:
+                    if not run.done():
+                        run.cancel()
+            cancel_slot.empty()
+            st.session_state.pop("resume_run", None)
+            
             # Display results
             st.header("Your Learning Path")
+            if result.get("similar_to"):
+                st.caption(f"Served from cache: reused the path generated for a similar goal, \"{result['similar_to']}\" (similarity {result.get('similarity')}).")
+            elif result.get("cached"):
+                st.caption("Served from cache: this goal was generated before.")
+            elif result.get("tools_unavailable"):
+                st.warning(f"YouTube tools were unavailable ({result['tools_unavailable']}), so this path was generated directly without tools; video links come from the model.")
+            elif result.get("direct"):
+                st.caption("Generated directly without tools; video links come from the model.")
+            elif result.get("degraded"):
+                st.caption("Some tools were unavailable during this run; affected video links are searches or come from the model.")
+            saved_to = result.get("saved_to")
+            if saved_to:
+                if saved_to["ok"]:
+                    st.success(f"Saved to {saved_to['tool'].title()}: {saved_to['info']}")
+                else:
+                    st.warning(f"Could not save the cached path to {saved_to['tool'].title()}: {saved_to['info']}")
+            if result.get("budget_exceeded"):
+                st.warning(f"Generation stopped early because the run budget was exceeded: {result['budget_exceeded']}")
+            if result.get("usage"):
+                with st.expander("Run usage"):
+                    st.json(result["usage"])
             full_text = concatenate_messages(result)
             clean_text = sanitize_learning_path_text(full_text)
             if clean_text:
@@ -156,7 +267,7 @@ if col_gen.button("Generate Learning Path", type="primary", disabled=st.session_
                 st.session_state["last_generated_text"] = clean_text
 
                 # Show day-wise readable plan with tracking
-                day_items = extract_days_and_questions(clean_text)
+                day_items = result.get("day_items") or extract_days_and_questions(clean_text)
                 if day_items:
                     st.subheader("Day-wise Plan and Practice Questions")
                     # Load existing progress
@@ -197,20 +308,31 @@ if col_gen.button("Generate Learning Path", type="primary", disabled=st.session_
                     "tool": secondary_tool,
                     "has_drive": bool(drive_pipedream_url),
                     "has_notion": bool(notion_pipedream_url),
-                    "content": clean_text
+                    "content": clean_text,
+                    "learning_path": result.get("learning_path")
                 })
 
             else:
                 st.error("No results were generated. Please try again.")
-                st.session_state.is_generating = False
         except Exception as e:
             import traceback
-            err_msg = f"An error occurred: {str(e)}"
-            st.error(err_msg)
-            st.error("Please check your API keys and URLs, and try again.")
+            cancel_slot.empty()
+            if isinstance(e, ResumableGenerationError):
+                st.session_state.resume_run = {"thread_id": e.thread_id, "goal": user_goal, "mode": run_mode}
+                st.error(f"An error occurred: {str(e)}")
+                st.info("Progress up to the failure was saved. Use \"Resume Failed Generation\" to continue from there.")
+            elif isinstance(e, CircuitOpenError):
+                st.error(f"A service is temporarily unavailable: {str(e)}")
+            else:
+                err_msg = f"An error occurred: {str(e)}"
+                st.error(err_msg)
+                st.error("Please check your API keys and URLs, and try again.")
             if debug_mode:
                 st.exception(e)
                 st.code(traceback.format_exc())
+        finally:
+            # Also runs when a rerun (Cancel, or any widget change) interrupts the script,
+            # which raises a BaseException that skips the except above
             st.session_state.is_generating = False
 
 # Export to PDF (and auto-upload to Drive if configured)
@@ -273,6 +395,12 @@ if history:
     drive_count = sum(1 for h in history if h.get("has_drive"))
     notion_count = sum(1 for h in history if h.get("has_notion"))
     st.write(f"Used Drive: {drive_count} | Used Notion: {notion_count}")
+    compaction = get_tool_compaction_stats()
+    if compaction["calls"]:
+        st.caption(
+            f"Tool output compaction: {compaction['bytes_saved'] / 1024:.1f} KB saved "
+            f"(~{compaction['tokens_saved_est']} tokens, {compaction['saved_pct']}%) over {compaction['calls']} tool calls"
+        )
 
     with st.expander("View History"):
         for i, rec in enumerate(reversed(history), start=1):
@@ -281,7 +409,10 @@ if history:
             # Minimal, readable content only
             st.text_area("Learning Path", value=rec.get("content",""), height=200, key=f"hist_content_{i}")
             # Day-wise tracking with questions
-            items = extract_days_and_questions(rec.get("content",""))
+            if rec.get("learning_path"):
+                items = learning_path_to_day_items(rec["learning_path"])
+            else:
+                items = extract_days_and_questions(rec.get("content",""))
             if items:
                 # Load progress for this goal
                 progress_data = load_progress(rec.get("goal", ""))
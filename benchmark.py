@@ -0,0 +1,284 @@
+"""
+End-to-end generation benchmark. Runs a matrix of goals x day counts through
+run_agent_sync (or stream_learning_path with --stream) and reports p50/p95/p99 latency
+per phase: setup, tool_discovery, first_token, llm_loop, sanitize, parse, persistence
+and total. Results are written as JSON so runs on different commits can be compared.
+
+Offline, against the fake MCP server and the scripted model:
+
+    python fake_mcp_server.py --app youtube --port 8765 &
+    python benchmark.py --scripted --repeats 5 --output bench.json
+
+Against real backends, pass --youtube-url and set GOOGLE_API_KEY. Compare with a
+previous run using --compare baseline.json.
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+import utils
+
+DEFAULT_GOALS = ["Learn Python basics", "Learn SQL for data analysis", "Learn machine learning fundamentals"]
+DEFAULT_DAYS = [3, 7, 30, 90]
+PHASES = ["setup", "tool_discovery", "first_token", "llm_loop", "sanitize", "parse", "persistence", "total"]
+PERCENTILES = (50, 95, 99)
+# Phases a mode never goes through; reported as "n/a" rather than left out
+NOT_APPLICABLE = {"direct": ["setup", "tool_discovery"]}
+
+
+def percentile(values: List[float], pct: float) -> float:
+    """Nearest-rank percentile of a non-empty list."""
+    ordered = sorted(values)
+    rank = max(1, -(-len(ordered) * pct // 100))
+    return ordered[int(rank) - 1]
+
+
+def summarize(values: List[float]) -> Dict[str, Any]:
+    summary: Dict[str, Any] = {"n": len(values)}
+    if values:
+        summary.update({f"p{p}": round(percentile(values, p), 4) for p in PERCENTILES})
+        summary["mean"] = round(sum(values) / len(values), 4)
+    return summary
+
+
+def summarize_runs(runs: List[Dict[str, Any]], mode: str) -> Dict[str, Dict[str, Any]]:
+    ok = [run for run in runs if not run.get("error")]
+    summary = {}
+    for phase in PHASES:
+        if phase in NOT_APPLICABLE.get(mode, []):
+            summary[phase] = {"n": 0, "not_applicable": True}
+        else:
+            summary[phase] = summarize([run["timings"][phase] for run in ok if phase in run["timings"]])
+    return summary
+
+
+def git_commit() -> Optional[str]:
+    try:
+        out = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True, text=True, timeout=10
+        )
+        return out.stdout.strip() or None
+    except Exception:
+        return None
+
+
+def use_data_dir(path: str) -> None:
+    """Keep history, checkpoints and tool schemas of benchmark runs out of the app's data/."""
+    utils.DATA_DIR = path
+    utils.CHECKPOINT_PATH = os.path.join(path, "checkpoints.sqlite")
+
+
+def seed_history(records: int) -> str:
+    """
+    Point HISTORY_PATH at a file the benchmark owns and write a seed history of `records`
+    plans next to it. Returns the seed path; run_once restores it before every timed write.
+    """
+    bench_dir = tempfile.mkdtemp(prefix="learning-path-bench-history-")
+    utils.HISTORY_PATH = os.path.join(bench_dir, "history.json")
+    seed_path = os.path.join(bench_dir, "history.seed.json")
+    content = "\n\n".join(
+        f"Day {day}: Topic {day}\n" + "\n".join(f"{q}. Question {q} about topic {day}?" for q in range(1, 11))
+        for day in range(1, 8)
+    )
+    history = [
+        {
+            "timestamp": datetime.now().isoformat(),
+            "goal": f"Seed goal {i} in 7 days",
+            "content": content,
+            "learning_path": None,
+        }
+        for i in range(records)
+    ]
+    with open(seed_path, "w", encoding="utf-8") as f:
+        json.dump(history, f, ensure_ascii=False, indent=2)
+    return seed_path
+
+
+def reset_warm_state() -> None:
+    """Drop pooled agents, model clients, cached tool results and cached tool schemas (for --cold runs)."""
+    utils.agent_pool.clear()
+    utils._model_instances.clear()
+    utils.tool_result_cache.clear()
+    utils._last_revalidated.clear()
+    schema_dir = os.path.join(utils.DATA_DIR, "tool_schemas")
+    if os.path.isdir(schema_dir):
+        for name in os.listdir(schema_dir):
+            os.remove(os.path.join(schema_dir, name))
+
+
+def _generate(args: argparse.Namespace, goal: str) -> Dict[str, Any]:
+    kwargs = dict(
+        google_api_key=args.google_api_key,
+        youtube_pipedream_url=args.youtube_url,
+        drive_pipedream_url=args.drive_url,
+        notion_pipedream_url=args.notion_url,
+        user_goal=goal,
+        use_cache=False,
+    )
+    if not args.stream:
+        return utils.run_agent_sync(mode=args.mode, coalesce=False, **kwargs)
+    for event in utils.stream_learning_path(**kwargs):
+        if event["type"] == "done":
+            return event["result"]
+    raise RuntimeError("Stream ended without a result")
+
+
+def run_once(args: argparse.Namespace, goal: str, days: int) -> Dict[str, Any]:
+    user_goal = f"{goal} in {days} days"
+    run: Dict[str, Any] = {"goal": user_goal, "days": days}
+    started = time.perf_counter()
+    try:
+        result = _generate(args, user_goal)
+        timings = dict(result.get("timings") or {})
+
+        phase_started = time.perf_counter()
+        clean_text = utils.sanitize_learning_path_text(utils.concatenate_messages(result))
+        timings["sanitize"] = time.perf_counter() - phase_started
+
+        phase_started = time.perf_counter()
+        day_items = result.get("day_items") or utils.extract_days_and_questions(clean_text)
+        timings["parse"] = time.perf_counter() - phase_started
+
+        # Start every write from the same seeded history, so the timing does not grow with earlier runs
+        shutil.copyfile(args.history_seed, utils.HISTORY_PATH)
+        phase_started = time.perf_counter()
+        utils.save_history_record({
+            "timestamp": datetime.now().isoformat(),
+            "goal": user_goal,
+            "content": clean_text,
+            "learning_path": result.get("learning_path"),
+        })
+        timings["persistence"] = time.perf_counter() - phase_started
+
+        timings["total"] = time.perf_counter() - started
+        run["timings"] = {phase: round(seconds, 4) for phase, seconds in timings.items()}
+        run["days_parsed"] = len(day_items)
+        run["usage"] = result.get("usage")
+        for flag in ("budget_exceeded", "early_stopped"):
+            if result.get(flag):
+                run[flag] = result[flag]
+    except Exception as e:
+        run["timings"] = {"total": round(time.perf_counter() - started, 4)}
+        run["error"] = f"{type(e).__name__}: {e}"
+    return run
+
+
+def compare(report: Dict[str, Any], baseline: Dict[str, Any]) -> None:
+    """Print p50/p95 per phase against a baseline report."""
+    print(f"\nvs {baseline.get('label') or baseline.get('commit') or 'baseline'}:")
+    for phase in PHASES:
+        current = report["summary"].get(phase, {})
+        previous = baseline.get("summary", {}).get(phase, {})
+        if not current.get("n") or not previous.get("n"):
+            continue
+        cells = []
+        for key in ("p50", "p95"):
+            delta = (current[key] - previous[key]) / previous[key] * 100 if previous[key] else 0.0
+            cells.append(f"{key} {previous[key]:.3f}s -> {current[key]:.3f}s ({delta:+.1f}%)")
+        print(f"  {phase:<15} " + "  ".join(cells))
+
+
+def print_summary(summary: Dict[str, Dict[str, Any]]) -> None:
+    print(f"{'phase':<15} {'n':>4} {'p50':>9} {'p95':>9} {'p99':>9}")
+    for phase in PHASES:
+        stats = summary.get(phase, {})
+        if stats.get("not_applicable"):
+            print(f"{phase:<15} {'n/a':>4}")
+        elif stats.get("n"):
+            print(f"{phase:<15} {stats['n']:>4} {stats['p50']:>9.3f} {stats['p95']:>9.3f} {stats['p99']:>9.3f}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="End-to-end learning path generation benchmark")
+    parser.add_argument("--goals", nargs="+", default=DEFAULT_GOALS)
+    parser.add_argument("--days", nargs="+", type=int, default=DEFAULT_DAYS)
+    parser.add_argument("--repeats", type=int, default=3, help="Runs per goal and day count")
+    parser.add_argument("--mode", choices=utils.GENERATION_MODES, default="agent")
+    parser.add_argument("--stream", action="store_true", help="Use stream_learning_path (agent mode only)")
+    parser.add_argument("--cold", action="store_true", help="Drop pooled agents and cached tools before every run")
+    parser.add_argument("--scripted", action="store_true", help="Route every model stage to the scripted model")
+    parser.add_argument("--model-latency", type=float, default=0.5, help="Scripted model latency per turn (seconds)")
+    parser.add_argument("--tokens-per-second", type=float, default=0.0, help="Scripted model streaming rate, 0 for instant")
+    parser.add_argument("--youtube-url", default="http://127.0.0.1:8765/mcp")
+    parser.add_argument("--drive-url", default=None)
+    parser.add_argument("--notion-url", default=None)
+    parser.add_argument("--google-api-key", default=os.environ.get("GOOGLE_API_KEY", ""))
+    parser.add_argument("--data-dir", default=None, help="Defaults to a temporary directory")
+    parser.add_argument("--history-records", type=int, default=200, help="Plans in the seeded history file")
+    parser.add_argument("--label", default=None, help="Name for this run in the report, e.g. a branch")
+    parser.add_argument("--output", default=None, help="Write the JSON report here")
+    parser.add_argument("--compare", default=None, help="Baseline JSON report to compare against")
+    args = parser.parse_args()
+
+    if args.stream and args.mode != "agent":
+        parser.error("--stream only supports --mode agent")
+    if args.scripted:
+        route = {"provider": "scripted", "latency_s": args.model_latency, "tokens_per_second": args.tokens_per_second}
+        utils.configure_model_routes({stage: route for stage in utils.MODEL_ROUTES})
+        args.google_api_key = args.google_api_key or "scripted"
+    elif not args.google_api_key:
+        parser.error("Set GOOGLE_API_KEY or pass --google-api-key (or use --scripted)")
+    use_data_dir(args.data_dir or tempfile.mkdtemp(prefix="learning-path-bench-"))
+    args.history_seed = seed_history(args.history_records)
+
+    runs: List[Dict[str, Any]] = []
+    total_runs = len(args.goals) * len(args.days) * args.repeats
+    for days in args.days:
+        for goal in args.goals:
+            for _ in range(args.repeats):
+                if args.cold:
+                    reset_warm_state()
+                run = run_once(args, goal, days)
+                runs.append(run)
+                status = run.get("error") or f"{run['timings']['total']:.2f}s, {run['days_parsed']} days parsed"
+                print(f"[{len(runs)}/{total_runs}] {run['goal']}: {status}", file=sys.stderr)
+
+    report = {
+        "label": args.label,
+        "commit": git_commit(),
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "config": {
+            "mode": args.mode,
+            "stream": args.stream,
+            "cold": args.cold,
+            "scripted": args.scripted,
+            "model_latency_s": args.model_latency if args.scripted else None,
+            "repeats": args.repeats,
+            "goals": args.goals,
+            "days": args.days,
+            "history_records": args.history_records,
+            "tools": {"youtube": args.youtube_url, "drive": bool(args.drive_url), "notion": bool(args.notion_url)},
+        },
+        "errors": sum(1 for run in runs if run.get("error")),
+        "summary": summarize_runs(runs, args.mode),
+        "by_days": {
+            str(days): summarize_runs([run for run in runs if run["days"] == days], args.mode) for days in args.days
+        },
+        "runs": runs,
+    }
+
+    print_summary(report["summary"])
+    if report["errors"]:
+        print(f"{report['errors']} of {len(runs)} runs failed")
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            compare(report, json.load(f))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"Report written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,204 @@
+"""
+Local stand-in for the Pipedream YouTube, Drive and Notion MCP servers, for offline
+benchmarking and load tests. Tool names, arguments and result shapes follow the real
+servers (YouTube results use the YouTube Data API JSON layout), results are deterministic
+for a given query, and latency, payload size and error rate are configurable.
+
+Run one process per server and use its URL in place of the Pipedream URL:
+
+    python fake_mcp_server.py --app youtube --port 8765 --latency-ms 150 --results 10
+    python fake_mcp_server.py --app drive --port 8766
+
+Each server listens on http://127.0.0.1:<port>/mcp (streamable_http transport).
+"""
+import argparse
+import asyncio
+import base64
+import hashlib
+import json
+import random
+from datetime import datetime, timedelta
+
+from mcp.server.fastmcp import FastMCP
+
+DEFAULT_PORTS = {"youtube": 8765, "drive": 8766, "notion": 8767}
+
+_CHANNELS = ["freeCodeCamp.org", "Corey Schafer", "Programming with Mosh", "CS Dojo", "Tech With Tim", "StatQuest"]
+
+
+def _stable_id(*parts: object, length: int = 11) -> str:
+    """YouTube-style id ([A-Za-z0-9_-]) derived from the inputs, so repeated calls agree."""
+    digest = hashlib.sha256("|".join(str(p) for p in parts).encode("utf-8")).digest()
+    return base64.urlsafe_b64encode(digest).decode("ascii").rstrip("=")[:length]
+
+
+class FakeBackend:
+    """Simulated latency, failures and payload sizes shared by every tool of a server."""
+
+    def __init__(
+        self,
+        latency_ms: float = 100.0,
+        jitter_ms: float = 30.0,
+        max_results: int = 10,
+        description_bytes: int = 300,
+        error_rate: float = 0.0,
+        seed: int = 0
+    ):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.max_results = max_results
+        self.description_bytes = description_bytes
+        self.error_rate = error_rate
+        self._rng = random.Random(seed)
+
+    async def respond(self) -> None:
+        """Wait out the simulated latency, then fail with a retryable error at error_rate."""
+        delay_ms = max(0.0, self._rng.gauss(self.latency_ms, self.jitter_ms)) if self.jitter_ms else self.latency_ms
+        await asyncio.sleep(delay_ms / 1000.0)
+        if self.error_rate and self._rng.random() < self.error_rate:
+            raise RuntimeError("503 Service Unavailable (simulated)")
+
+    def description(self, topic: str) -> str:
+        sentence = f"A complete, beginner friendly walkthrough of {topic} with examples and exercises. "
+        return (sentence * (self.description_bytes // len(sentence) + 1))[: self.description_bytes]
+
+
+def _search_item(backend: FakeBackend, query: str, rank: int) -> dict:
+    video_id = _stable_id("video", query.casefold(), rank)
+    published = datetime(2024, 1, 1) + timedelta(days=_stable_id("date", query, rank).encode()[0] * 3)
+    return {
+        "kind": "youtube#searchResult",
+        "etag": _stable_id("etag", video_id, length=27),
+        "id": {"kind": "youtube#video", "videoId": video_id},
+        "snippet": {
+            "publishedAt": published.strftime("%Y-%m-%dT%H:%M:%SZ"),
+            "channelId": "UC" + _stable_id("channel", rank % len(_CHANNELS), length=22),
+            "title": f"{query.title()} - Full Course Part {rank + 1}",
+            "description": backend.description(query),
+            "thumbnails": {
+                size: {"url": f"https://i.ytimg.com/vi/{video_id}/{size}.jpg", "width": w, "height": h}
+                for size, w, h in (("default", 120, 90), ("medium", 320, 180), ("high", 480, 360))
+            },
+            "channelTitle": _CHANNELS[rank % len(_CHANNELS)],
+            "liveBroadcastContent": "none",
+        },
+    }
+
+
+def register_youtube_tools(server: FastMCP, backend: FakeBackend) -> None:
+    @server.tool()
+    async def search_videos(q: str, maxResults: int = 5) -> str:
+        """Search YouTube for videos matching a query. Returns YouTube Data API search results."""
+        await backend.respond()
+        count = max(1, min(maxResults, backend.max_results))
+        return json.dumps({
+            "kind": "youtube#searchListResponse",
+            "regionCode": "US",
+            "pageInfo": {"totalResults": 1000000, "resultsPerPage": count},
+            "items": [_search_item(backend, q, rank) for rank in range(count)],
+        })
+
+    @server.tool()
+    async def get_video_details(id: str) -> str:
+        """Get details (snippet, duration, statistics) for a comma-separated list of video ids."""
+        await backend.respond()
+        items = []
+        for video_id in [v.strip() for v in id.split(",") if v.strip()]:
+            seed = _stable_id("stats", video_id, length=6).encode()
+            items.append({
+                "kind": "youtube#video",
+                "id": video_id,
+                "snippet": {
+                    "title": f"Video {video_id}",
+                    "description": backend.description(video_id),
+                    "channelTitle": _CHANNELS[seed[0] % len(_CHANNELS)],
+                },
+                "contentDetails": {"duration": f"PT{10 + seed[1] % 80}M{seed[2] % 60}S", "definition": "hd"},
+                "statistics": {"viewCount": str(1000 * (seed[3] + 1) * (seed[4] + 1)), "likeCount": str(50 * (seed[5] + 1))},
+            })
+        return json.dumps({"kind": "youtube#videoListResponse", "items": items})
+
+
+def register_drive_tools(server: FastMCP, backend: FakeBackend) -> None:
+    @server.tool()
+    async def upload_file(name: str, content: str, mimeType: str = "application/pdf") -> str:
+        """Upload a file to Google Drive. content is the base64-encoded file body."""
+        await backend.respond()
+        file_id = _stable_id("file", name, len(content), length=33)
+        return json.dumps({
+            "id": file_id,
+            "name": name,
+            "mimeType": mimeType,
+            "size": str(len(content) * 3 // 4),
+            "webViewLink": f"https://drive.google.com/file/d/{file_id}/view",
+        })
+
+    @server.tool()
+    async def list_files(query: str = "") -> str:
+        """List Google Drive files whose name contains the query."""
+        await backend.respond()
+        return json.dumps({"files": [
+            {"id": _stable_id("file", query, i, length=33), "name": f"{query or 'Document'} {i + 1}.pdf"}
+            for i in range(min(5, backend.max_results))
+        ]})
+
+
+def register_notion_tools(server: FastMCP, backend: FakeBackend) -> None:
+    @server.tool()
+    async def create_page(title: str, content: str) -> str:
+        """Create a Notion page with a title and markdown content."""
+        await backend.respond()
+        page_id = _stable_id("page", title, len(content), length=32)
+        return json.dumps({"object": "page", "id": page_id, "url": f"https://www.notion.so/{page_id}"})
+
+    @server.tool()
+    async def search_pages(query: str) -> str:
+        """Search Notion pages by title."""
+        await backend.respond()
+        return json.dumps({"object": "list", "results": [
+            {"object": "page", "id": _stable_id("page", query, i, length=32), "title": f"{query} notes {i + 1}"}
+            for i in range(min(5, backend.max_results))
+        ]})
+
+
+TOOL_SETS = {
+    "youtube": register_youtube_tools,
+    "drive": register_drive_tools,
+    "notion": register_notion_tools,
+}
+
+
+def build_server(app: str, backend: FakeBackend, host: str = "127.0.0.1", port: int = 0) -> FastMCP:
+    server = FastMCP(f"fake-{app}", host=host, port=port or DEFAULT_PORTS[app])
+    TOOL_SETS[app](server, backend)
+    return server
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Fake Pipedream MCP server for offline benchmarking")
+    parser.add_argument("--app", choices=sorted(TOOL_SETS), default="youtube")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=0, help="Defaults to 8765/8766/8767 for youtube/drive/notion")
+    parser.add_argument("--latency-ms", type=float, default=100.0, help="Mean latency per tool call")
+    parser.add_argument("--jitter-ms", type=float, default=30.0, help="Standard deviation of the latency")
+    parser.add_argument("--results", type=int, default=10, help="Upper bound on search results per call")
+    parser.add_argument("--description-bytes", type=int, default=300, help="Size of each video description")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of calls failing with a 503")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    backend = FakeBackend(
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        max_results=args.results,
+        description_bytes=args.description_bytes,
+        error_rate=args.error_rate,
+        seed=args.seed,
+    )
+    server = build_server(args.app, backend, host=args.host, port=args.port)
+    print(f"Fake {args.app} MCP server on http://{args.host}:{server.settings.port}/mcp")
+    server.run(transport="streamable-http")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,296 @@
+"""
+Scripted stand-in for the Gemini chat model, for offline benchmarking and load tests.
+It replays a realistic ReAct trace for the learning path prompt: searches for each day's
+topic through the bound YouTube search tool a few calls per turn, then writes the
+day-wise path in the prompt's format, using the video ids found. Schema-constrained calls
+(LearningPlan, VideoChoice, DayQuestions, LearningPath) get matching tool-call
+arguments, so every generation mode works. Latency, streaming speed and token usage are
+simulated; output is deterministic for a given goal.
+
+Select it per pipeline stage through the model routes:
+
+    configure_model_routes({stage: {"provider": "scripted"} for stage in MODEL_ROUTES})
+"""
+import asyncio
+import json
+import re
+import time
+from typing import Any, Dict, Iterator, AsyncIterator, List, Optional, Sequence, Tuple
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from langchain_core.utils.function_calling import convert_to_openai_tool
+
+_GOAL_RE = re.compile(r"(?:User Goal|learning path for this goal|Learning goal):\s*(.+)", flags=re.IGNORECASE)
+_DAYS_RE = re.compile(r"\b(\d{1,3})\s*(day|week)s?\b", flags=re.IGNORECASE)
+_DURATION_RE = re.compile(r"\s*\b(?:in|within|over|for)?\s*\d{1,3}\s*(?:day|week)s?\b", flags=re.IGNORECASE)
+_DAY_TOPIC_RE = re.compile(r"Day\s+\d+\s+topic:\s*(.+)", flags=re.IGNORECASE)
+_VIDEO_ID_RE = re.compile(
+    r"(?:\"videoId\"\s*:\s*\"|\"id\"\s*:\s*\"|watch\?v=|youtu\.be/|Videos: |; )([A-Za-z0-9_-]{11})(?![A-Za-z0-9_-])"
+)
+_SEARCH_ARG_NAMES = ("q", "query", "search_query", "searchQuery", "keyword", "keywords", "term")
+
+_TOPIC_STAGES = [
+    "Introduction and Setup", "Core Concepts", "Essential Syntax and Building Blocks", "Working with Data",
+    "Control Flow and Logic", "Functions and Modularity", "Common Libraries and Tools", "Debugging and Testing",
+    "Intermediate Techniques", "Best Practices", "Real-World Project", "Performance and Optimization",
+    "Advanced Topics", "Review and Next Steps",
+]
+_QUESTION_TEMPLATES = [
+    "In your own words, what is the main purpose of {topic}?",
+    "Which key terms were introduced in {topic}, and how do they relate to each other?",
+    "Describe a real-world situation where {topic} would be useful.",
+    "What is a common beginner mistake with {topic}, and how can it be avoided?",
+    "Write a short example that demonstrates {topic}.",
+    "How does {topic} build on what you learned on previous days?",
+    "Compare two different approaches covered in {topic}. When would you choose each?",
+    "Explain step by step what happens in a typical {topic} workflow.",
+    "How would you verify that your work on {topic} is correct?",
+    "Design a small exercise that would test a friend's understanding of {topic}.",
+]
+
+
+def _message_text(message: BaseMessage) -> str:
+    content = message.content
+    if isinstance(content, str):
+        return content
+    return "\n".join(part.get("text", "") if isinstance(part, dict) else str(part) for part in content)
+
+
+def _approx_tokens(text: str) -> int:
+    return max(1, len(text) // 4)
+
+
+class ScriptedChatModel(BaseChatModel):
+    """Deterministic chat model that replays ReAct and structured-output traces offline."""
+
+    model: str = "scripted"
+    temperature: Optional[float] = None
+    # Seconds before the first token of every call
+    latency_s: float = 0.5
+    # Streaming speed; 0 streams the whole answer at once
+    tokens_per_second: float = 0.0
+    # Parallel search tool calls per agent turn
+    searches_per_turn: int = 5
+    # Day count when the goal does not state one
+    default_days: int = 7
+
+    @property
+    def _llm_type(self) -> str:
+        return "scripted-chat-model"
+
+    def bind_tools(self, tools: Sequence[Any], *, tool_choice: Optional[Any] = None, **kwargs: Any) -> Any:
+        return self.bind(tools=[convert_to_openai_tool(t) for t in tools], tool_choice=tool_choice, **kwargs)
+
+    # -----------------------------
+    # Script
+    # -----------------------------
+
+    def _goal_and_days(self, messages: List[BaseMessage]) -> Tuple[str, int]:
+        text = "\n".join(_message_text(m) for m in messages if m.type == "human")
+        match = _GOAL_RE.search(text)
+        goal = match.group(1).strip() if match else (text.strip().splitlines() or ["your goal"])[0]
+        # The goal's own duration wins over day counts elsewhere in the prompt
+        days_match = _DAYS_RE.search(goal) or _DAYS_RE.search(text)
+        if days_match:
+            days = int(days_match.group(1)) * (7 if days_match.group(2).lower() == "week" else 1)
+        else:
+            days = self.default_days
+        return goal, max(1, days)
+
+    @staticmethod
+    def _subject(goal: str) -> str:
+        subject = re.sub(r"^(?:i\s+want\s+to\s+|help\s+me\s+)?(?:learn|master|study)\s+", "", goal, flags=re.IGNORECASE)
+        subject = _DURATION_RE.sub("", subject)
+        return re.sub(r"\s+", " ", subject).strip(" .") or goal
+
+    def _topics(self, goal: str, days: int) -> List[str]:
+        subject = self._subject(goal).title()
+        return [
+            f"{subject} {_TOPIC_STAGES[i % len(_TOPIC_STAGES)]}" + (f" {i // len(_TOPIC_STAGES) + 1}" if i >= len(_TOPIC_STAGES) else "")
+            for i in range(days)
+        ]
+
+    @staticmethod
+    def _questions(topic: str) -> List[str]:
+        return [template.format(topic=topic) for template in _QUESTION_TEMPLATES]
+
+    @staticmethod
+    def _found_videos(messages: List[BaseMessage]) -> Dict[str, str]:
+        """First video id from each tool result, keyed by tool_call_id."""
+        found: Dict[str, str] = {}
+        for m in messages:
+            if m.type == "tool":
+                match = _VIDEO_ID_RE.search(_message_text(m))
+                if match:
+                    found[getattr(m, "tool_call_id", "")] = match.group(1)
+        return found
+
+    @staticmethod
+    def _video_url(video_id: Optional[str], topic: str) -> str:
+        if video_id:
+            return f"https://www.youtube.com/watch?v={video_id}"
+        return "https://www.youtube.com/results?search_query=" + "+".join((topic + " tutorial").split())
+
+    @staticmethod
+    def _search_call(tool: Dict[str, Any], query: str, call_id: str) -> Dict[str, Any]:
+        function = tool["function"]
+        properties = (function.get("parameters") or {}).get("properties") or {}
+        arg_name = next((n for n in _SEARCH_ARG_NAMES if n in properties), None)
+        if arg_name is None:
+            arg_name = next((n for n, spec in properties.items() if spec.get("type") == "string"), "q")
+        args: Dict[str, Any] = {arg_name: query}
+        for limit_name in ("maxResults", "max_results", "limit"):
+            if limit_name in properties:
+                args[limit_name] = 5
+                break
+        return {"name": function["name"], "args": args, "id": call_id, "type": "tool_call"}
+
+    def _react_turn(self, messages: List[BaseMessage], tools: List[Dict[str, Any]]) -> AIMessage:
+        goal, days = self._goal_and_days(messages)
+        topics = self._topics(goal, days)
+        search_tools = [t for t in tools if "search" in t["function"]["name"].lower()]
+        search_tools.sort(key=lambda t: ("video" not in t["function"]["name"].lower(), len(t["function"]["name"])))
+        issued = sum(len(getattr(m, "tool_calls", None) or []) for m in messages if m.type == "ai")
+        if search_tools and issued < days:
+            calls = [
+                self._search_call(search_tools[0], f"{topics[i]} tutorial", f"call_day_{i + 1}")
+                for i in range(issued, min(days, issued + self.searches_per_turn))
+            ]
+            return AIMessage(content="", tool_calls=calls)
+
+        videos = self._found_videos(messages)
+        lines = [f"Learning Path: {self._subject(goal).title()} in {days} Days", ""]
+        for i, topic in enumerate(topics, start=1):
+            lines += [
+                f"Day {i}:",
+                f"Topic: {topic}",
+                f"YouTube Link: {self._video_url(videos.get(f'call_day_{i}'), topic)}",
+                "Practice Questions (10)",
+            ]
+            lines += [f"{n}. {q}" for n, q in enumerate(self._questions(topic), start=1)]
+            lines.append("")
+        lines += ["Top Channels or Institutes to Follow", "- freeCodeCamp.org", "- MIT OpenCourseWare"]
+        return AIMessage(content="\n".join(lines))
+
+    def _structured_args(self, schema: Dict[str, Any], messages: List[BaseMessage]) -> Dict[str, Any]:
+        name = schema["function"]["name"]
+        goal, days = self._goal_and_days(messages)
+        topics = self._topics(goal, days)
+        prompt = "\n".join(_message_text(m) for m in messages)
+        if name == "LearningPlan":
+            return {
+                "title": f"Learning Path: {self._subject(goal).title()}",
+                "days": [
+                    {"day": i, "topic": topic, "search_query": f"{topic} tutorial"}
+                    for i, topic in enumerate(topics, start=1)
+                ],
+            }
+        if name == "VideoChoice":
+            return {"index": 1}
+        if name == "DayQuestions":
+            match = _DAY_TOPIC_RE.search(prompt)
+            return {"questions": self._questions(match.group(1).strip() if match else self._subject(goal))}
+        if name == "LearningPath":
+            videos = self._found_videos(messages)
+            return {
+                "title": f"Learning Path: {self._subject(goal).title()}",
+                "days": [
+                    {
+                        "topic": topic,
+                        "video_url": self._video_url(videos.get(f"call_day_{i}"), topic),
+                        "questions": self._questions(topic),
+                    }
+                    for i, topic in enumerate(topics, start=1)
+                ],
+            }
+        return _fill_schema(schema["function"].get("parameters") or {})
+
+    def _respond(self, messages: List[BaseMessage], **kwargs: Any) -> AIMessage:
+        tools = kwargs.get("tools") or []
+        tool_choice = kwargs.get("tool_choice")
+        if tools and tool_choice and len(tools) == 1:
+            # with_structured_output: a forced call of the single schema tool
+            schema = tools[0]
+            message = AIMessage(content="", tool_calls=[{
+                "name": schema["function"]["name"],
+                "args": self._structured_args(schema, messages),
+                "id": "call_structured",
+                "type": "tool_call",
+            }])
+        else:
+            message = self._react_turn(messages, tools)
+        input_tokens = sum(_approx_tokens(_message_text(m)) for m in messages)
+        output_tokens = _approx_tokens(message.content or "") + sum(
+            _approx_tokens(json.dumps(call["args"])) for call in message.tool_calls
+        )
+        message.usage_metadata = {
+            "input_tokens": input_tokens,
+            "output_tokens": output_tokens,
+            "total_tokens": input_tokens + output_tokens,
+        }
+        message.response_metadata = {"model_name": self.model}
+        return message
+
+    # -----------------------------
+    # BaseChatModel interface
+    # -----------------------------
+
+    def _generate(self, messages: List[BaseMessage], stop: Any = None, run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        time.sleep(self.latency_s)
+        return ChatResult(generations=[ChatGeneration(message=self._respond(messages, **kwargs))])
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Any = None, run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        await asyncio.sleep(self.latency_s)
+        return ChatResult(generations=[ChatGeneration(message=self._respond(messages, **kwargs))])
+
+    def _chunks(self, message: AIMessage) -> Iterator[AIMessageChunk]:
+        if message.tool_calls:
+            yield AIMessageChunk(content="", tool_call_chunks=[
+                {"name": call["name"], "args": json.dumps(call["args"]), "id": call["id"], "index": i}
+                for i, call in enumerate(message.tool_calls)
+            ])
+        words = re.findall(r"\S+\s*", message.content or "")
+        for start in range(0, len(words), 4):
+            yield AIMessageChunk(content="".join(words[start:start + 4]))
+        yield AIMessageChunk(content="", usage_metadata=message.usage_metadata, response_metadata=message.response_metadata)
+
+    def _chunk_delay(self, chunk: AIMessageChunk) -> float:
+        if not self.tokens_per_second or not chunk.content:
+            return 0.0
+        return _approx_tokens(chunk.content) / self.tokens_per_second
+
+    def _stream(self, messages: List[BaseMessage], stop: Any = None, run_manager: Any = None, **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        time.sleep(self.latency_s)
+        for chunk in self._chunks(self._respond(messages, **kwargs)):
+            time.sleep(self._chunk_delay(chunk))
+            if run_manager and chunk.content:
+                run_manager.on_llm_new_token(chunk.content, chunk=ChatGenerationChunk(message=chunk))
+            yield ChatGenerationChunk(message=chunk)
+
+    async def _astream(self, messages: List[BaseMessage], stop: Any = None, run_manager: Any = None, **kwargs: Any) -> AsyncIterator[ChatGenerationChunk]:
+        await asyncio.sleep(self.latency_s)
+        for chunk in self._chunks(self._respond(messages, **kwargs)):
+            await asyncio.sleep(self._chunk_delay(chunk))
+            if run_manager and chunk.content:
+                await run_manager.on_llm_new_token(chunk.content, chunk=ChatGenerationChunk(message=chunk))
+            yield ChatGenerationChunk(message=chunk)
+
+
+def _fill_schema(schema: Dict[str, Any]) -> Any:
+    """Placeholder value matching a JSON schema, for structured calls without a script."""
+    kind = schema.get("type")
+    if "enum" in schema:
+        return schema["enum"][0]
+    if kind == "object" or "properties" in schema:
+        return {name: _fill_schema(spec) for name, spec in (schema.get("properties") or {}).items()}
+    if kind == "array":
+        return [_fill_schema(schema.get("items") or {})]
+    if kind == "integer":
+        return 1
+    if kind == "number":
+        return 1.0
+    if kind == "boolean":
+        return True
+    return "example"
@@ -1,142 +1,2899 @@
-from langchain_core.messages import HumanMessage
+from langchain_core.messages import HumanMessage, AIMessage
+from langchain_core.messages.utils import count_tokens_approximately
 from langchain_core.runnables import RunnableConfig
 from prompt import user_goal_prompt
 from langgraph.prebuilt import create_react_agent
 from langchain_mcp_adapters.client import MultiServerMCPClient
+from langchain_mcp_adapters.tools import convert_mcp_tool_to_langchain_tool
+from mcp.types import Tool as MCPTool
 from langchain_google_genai import ChatGoogleGenerativeAI
-from typing import Optional, Any, Callable, List, Dict, Tuple
+from pydantic import BaseModel, Field
+import httpx
+from typing import Optional, Any, Callable, List, Dict, Tuple, Set, AsyncIterator, Iterator
 import asyncio
 import os
+import queue
+import threading
+import concurrent.futures
+import contextlib
+import contextvars
+import functools
+import importlib.util
 import json
 import re
 from datetime import datetime
 from urllib.parse import quote_plus
 import base64
+import hashlib
+import random
+import zlib
+import time
+import uuid
+import weakref
+from collections import OrderedDict
 
 try:
     from fpdf import FPDF  
 except Exception:
     FPDF = None
 
+try:
+    from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
+except Exception:
+    AsyncSqliteSaver = None
+
 cfg = RunnableConfig(recursion_limit=100)
 
-def initialize_model(google_api_key: str) -> ChatGoogleGenerativeAI:
-    return ChatGoogleGenerativeAI(
-        model="gemini-2.5-flash",
-        google_api_key=google_api_key
-    )
 
-async def setup_agent_with_tools(
+# -----------------------------
+# Shared Event Loop
+# -----------------------------
+
+_shared_loop: Optional[asyncio.AbstractEventLoop] = None
+_shared_loop_thread: Optional[threading.Thread] = None
+_shared_loop_lock = threading.Lock()
+
+
+def _run_loop_forever(loop: asyncio.AbstractEventLoop) -> None:
+    asyncio.set_event_loop(loop)
+    loop.run_forever()
+
+
+def get_shared_loop() -> asyncio.AbstractEventLoop:
+    """
+    Return the process-wide background event loop, starting its thread on first use.
+    Every sync wrapper submits to this loop, so connections and other async resources
+    survive across Streamlit reruns and sessions instead of dying with a per-click loop.
+    """
+    global _shared_loop, _shared_loop_thread
+    with _shared_loop_lock:
+        if (
+            _shared_loop is None
+            or _shared_loop.is_closed()
+            or _shared_loop_thread is None
+            or not _shared_loop_thread.is_alive()
+        ):
+            loop = asyncio.new_event_loop()
+            thread = threading.Thread(
+                target=_run_loop_forever,
+                args=(loop,),
+                name="learning-path-event-loop",
+                daemon=True,
+            )
+            thread.start()
+            _shared_loop, _shared_loop_thread = loop, thread
+        return _shared_loop
+
+
+def _on_shared_loop() -> bool:
+    """True when running on the shared loop rather than a caller's own (e.g. asyncio.run) loop."""
+    try:
+        return asyncio.get_running_loop() is _shared_loop
+    except RuntimeError:
+        return False
+
+
+class RunHandle:
+    """
+    A coroutine running on the shared loop. cancel() cancels its task, which raises
+    CancelledError inside whatever it is awaiting (LangGraph steps, MCP calls, model calls)
+    so slots and connections are released right away. wait() blocks for the result and
+    delivers progress messages on the calling thread.
+    """
+
+    def __init__(self, future: concurrent.futures.Future, messages: "queue.Queue[str]"):
+        self._future = future
+        self._messages = messages
+
+    def cancel(self) -> bool:
+        return self._future.cancel()
+
+    def cancelled(self) -> bool:
+        return self._future.cancelled()
+
+    def done(self) -> bool:
+        return self._future.done()
+
+    def wait(
+        self,
+        progress_callback: Optional[Callable[[str], None]] = None,
+        heartbeat: Optional[Callable[[], None]] = None,
+        heartbeat_interval: float = 0.5
+    ) -> Any:
+        """
+        Block until the run ends and return its result (concurrent.futures.CancelledError if
+        it was cancelled). heartbeat is called every heartbeat_interval seconds while waiting,
+        e.g. to let Streamlit interrupt the script when the user clicks something.
+        """
+        last_beat = time.monotonic()
+        while True:
+            try:
+                message = self._messages.get(timeout=0.05)
+            except queue.Empty:
+                if self._future.done():
+                    break
+                if heartbeat and time.monotonic() - last_beat >= heartbeat_interval:
+                    last_beat = time.monotonic()
+                    heartbeat()
+                continue
+            if progress_callback:
+                progress_callback(message)
+        # Deliver anything queued between the last poll and completion
+        while progress_callback and not self._messages.empty():
+            progress_callback(self._messages.get_nowait())
+        return self._future.result()
+
+
+def submit_coroutine(
+    coro_fn: Callable[..., Any],
+    *args: Any,
+    relay_progress: bool = False,
+    **kwargs: Any
+) -> RunHandle:
+    """
+    Start coro_fn(*args, progress_callback=..., **kwargs) on the shared loop and return its
+    RunHandle without waiting. With relay_progress, progress messages are queued for wait().
+    """
+    loop = get_shared_loop()
+    try:
+        running = asyncio.get_running_loop()
+    except RuntimeError:
+        running = None
+    if running is loop:
+        raise RuntimeError("submit_coroutine cannot be called from the shared event loop")
+
+    messages: "queue.Queue[str]" = queue.Queue()
+    future = asyncio.run_coroutine_threadsafe(
+        coro_fn(*args, progress_callback=messages.put if relay_progress else None, **kwargs), loop
+    )
+    return RunHandle(future, messages)
+
+
+def run_coroutine_sync(
+    coro_fn: Callable[..., Any],
+    *args: Any,
+    progress_callback: Optional[Callable[[str], None]] = None,
+    **kwargs: Any
+) -> Any:
+    """
+    Run coro_fn(*args, progress_callback=..., **kwargs) on the shared loop and block until done.
+    Progress messages are relayed back and delivered on the calling thread, so Streamlit
+    widgets are still updated from the script thread that owns them.
+    """
+    handle = submit_coroutine(coro_fn, *args, relay_progress=progress_callback is not None, **kwargs)
+    try:
+        return handle.wait(progress_callback)
+    finally:
+        # The caller was interrupted (e.g. by an exception from its progress callback)
+        if not handle.done():
+            handle.cancel()
+
+
+def iterate_async_sync(
+    agen_fn: Callable[..., AsyncIterator[Any]],
+    *args: Any,
+    progress_callback: Optional[Callable[[str], None]] = None,
+    heartbeat: Optional[Callable[[], None]] = None,
+    heartbeat_interval: float = 0.5,
+    **kwargs: Any
+) -> Iterator[Any]:
+    """
+    Drive an async generator on the shared loop and yield its items on the calling thread.
+    Closing the returned generator early cancels the async side. heartbeat is called every
+    heartbeat_interval seconds while no item arrives, as in RunHandle.wait; an exception it
+    raises (e.g. Streamlit stopping the script) propagates and cancels the run.
+    """
+    loop = get_shared_loop()
+    items: "queue.Queue[Tuple[str, Any]]" = queue.Queue()
+
+    async def _pump(progress_callback: Optional[Callable[[str], None]] = None) -> None:
+        try:
+            async for item in agen_fn(*args, progress_callback=progress_callback, **kwargs):
+                items.put(("item", item))
+        except BaseException as e:
+            items.put(("error", e))
+            raise
+        finally:
+            items.put(("end", None))
+
+    relay = (lambda message: items.put(("progress", message))) if progress_callback else None
+    future = asyncio.run_coroutine_threadsafe(_pump(progress_callback=relay), loop)
+    try:
+        last_beat = time.monotonic()
+        while True:
+            try:
+                kind, payload = items.get(timeout=0.05)
+            except queue.Empty:
+                if heartbeat and time.monotonic() - last_beat >= heartbeat_interval:
+                    last_beat = time.monotonic()
+                    heartbeat()
+                continue
+            if kind == "item":
+                yield payload
+            elif kind == "progress":
+                progress_callback(payload)
+            elif kind == "error":
+                raise payload
+            else:
+                return
+    finally:
+        if not future.done():
+            future.cancel()
+
+
+# -----------------------------
+# Shared HTTP Connection Pool
+# -----------------------------
+
+HTTP_MAX_CONNECTIONS = 100
+HTTP_MAX_KEEPALIVE_CONNECTIONS = 20
+HTTP_KEEPALIVE_EXPIRY = 60.0
+# Same shape as the MCP SDK default: bounded connect/write, long reads for server-sent events
+HTTP_TIMEOUT = httpx.Timeout(30.0, connect=10.0, read=300.0)
+HTTP2_ENABLED = importlib.util.find_spec("h2") is not None
+
+# One pool per event loop: pooled connections cannot move between loops
+_http_pools: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, httpx.AsyncHTTPTransport]" = weakref.WeakKeyDictionary()
+
+
+class _SharedTransport(httpx.AsyncBaseTransport):
+    """A client's view of the shared pool; closing the client leaves the pool and its connections open."""
+
+    def __init__(self, pool: httpx.AsyncHTTPTransport):
+        self._pool = pool
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        return await self._pool.handle_async_request(request)
+
+    async def aclose(self) -> None:
+        pass
+
+
+def get_http_pool() -> httpx.AsyncHTTPTransport:
+    """The keep-alive connection pool (HTTP/2 when h2 is installed) for the running event loop."""
+    loop = asyncio.get_running_loop()
+    pool = _http_pools.get(loop)
+    if pool is None:
+        pool = _http_pools[loop] = httpx.AsyncHTTPTransport(
+            http2=HTTP2_ENABLED,
+            limits=httpx.Limits(
+                max_connections=HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=HTTP_MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+            ),
+        )
+    return pool
+
+
+def shared_httpx_client_factory(
+    headers: Optional[Dict[str, str]] = None,
+    timeout: Optional[httpx.Timeout] = None,
+    auth: Optional[httpx.Auth] = None
+) -> httpx.AsyncClient:
+    """
+    httpx_client_factory for MCP streamable_http connections. Every MCP session gets its own
+    lightweight client (headers, timeout, auth) over the shared pool, so sessions opened per
+    tool call reuse warm connections instead of opening new ones.
+    """
+    return httpx.AsyncClient(
+        transport=_SharedTransport(get_http_pool()),
+        headers=headers,
+        timeout=timeout or HTTP_TIMEOUT,
+        auth=auth,
+        follow_redirects=True,
+    )
+
+
+def mcp_connection(url: str) -> Dict[str, Any]:
+    """MultiServerMCPClient connection config for a Pipedream server, routed through the shared pool."""
+    return {
+        "url": url,
+        "transport": "streamable_http",
+        "httpx_client_factory": shared_httpx_client_factory,
+    }
+
+
+# -----------------------------
+# Agent Pool
+# -----------------------------
+
+class TTLCache:
+    """
+    Thread-safe LRU mapping with a max size and a TTL in seconds (None disables expiry).
+    With refresh_on_access=True the TTL is an idle timeout, reset by every successful get.
+    """
+
+    def __init__(self, max_size: int, ttl: Optional[float] = None, refresh_on_access: bool = True):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.refresh_on_access = refresh_on_access
+        self._data: "OrderedDict[Any, Tuple[Any, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _expired(self, stamp: float, now: float) -> bool:
+        return self.ttl is not None and now - stamp > self.ttl
+
+    def get(self, key: Any, default: Any = None) -> Any:
+        now = time.time()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return default
+            value, stamp = entry
+            if self._expired(stamp, now):
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            if self.refresh_on_access:
+                self._data[key] = (value, now)
+            return value
+
+    def set(self, key: Any, value: Any, stamp: Optional[float] = None) -> None:
+        with self._lock:
+            self._data[key] = (value, time.time() if stamp is None else stamp)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def pop(self, key: Any, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._data.pop(key, None)
+        return entry[0] if entry else default
+
+    def items(self) -> List[Tuple[Any, Any, float]]:
+        """Return live (key, value, stamp) triples, oldest first."""
+        now = time.time()
+        with self._lock:
+            for key in [k for k, (_, st) in self._data.items() if self._expired(st, now)]:
+                del self._data[key]
+            return [(k, v, st) for k, (v, st) in self._data.items()]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self.items())
+
+
+def api_key_fingerprint(google_api_key: str) -> str:
+    """Short, non-reversible identifier for an API key, safe to use in cache keys."""
+    return hashlib.sha256((google_api_key or "").encode("utf-8")).hexdigest()[:16]
+
+
+class AgentPool:
+    """
+    Ready-to-invoke agents keyed by (API key fingerprint, YouTube URL, Drive URL, Notion URL),
+    with LRU eviction beyond max_size and eviction after idle_ttl seconds without use.
+    Agents hold model clients and a checkpointer bound to the loop they were built on, so
+    only agents built on the shared loop are pooled; a run on a caller's own loop builds an
+    agent that is dropped with that loop. Keys also carry the loop so concurrent builds on
+    different loops are never coalesced.
+    """
+
+    def __init__(self, max_size: int = 16, idle_ttl: float = 15 * 60):
+        self._agents = TTLCache(max_size=max_size, ttl=idle_ttl, refresh_on_access=True)
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(
+        google_api_key: str,
+        youtube_pipedream_url: Optional[str],
+        drive_pipedream_url: Optional[str] = None,
+        notion_pipedream_url: Optional[str] = None,
+        *variant: Any
+    ) -> Tuple[Any, ...]:
+        return (
+            api_key_fingerprint(google_api_key),
+            youtube_pipedream_url or None,
+            drive_pipedream_url or None,
+            notion_pipedream_url or None,
+        ) + tuple(variant) + (id(asyncio.get_running_loop()),)
+
+    def _pool(self) -> Optional[TTLCache]:
+        if not _on_shared_loop():
+            return None
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if self._loop is not loop:
+                # The shared loop was restarted; agents bound to the old one are unusable
+                self._agents.clear()
+                self._loop = loop
+        return self._agents
+
+    def get(self, key: Tuple[Any, ...]) -> Any:
+        pool = self._pool()
+        return pool.get(key) if pool is not None else None
+
+    def put(self, key: Tuple[Any, ...], agent: Any) -> None:
+        pool = self._pool()
+        if pool is not None:
+            pool.set(key, agent)
+
+    def invalidate_url(self, url: str) -> int:
+        """Drop every pooled agent that talks to the given server URL. Returns the count dropped."""
+        dropped = 0
+        for key, _, _ in self._agents.items():
+            if url in key[1:4]:
+                self._agents.pop(key)
+                dropped += 1
+        return dropped
+
+    def clear(self) -> None:
+        self._agents.clear()
+
+    def __len__(self) -> int:
+        return len(self._agents)
+
+
+agent_pool = AgentPool()
+
+
+# -----------------------------
+# Request Coalescing
+# -----------------------------
+
+class _Flight:
+    def __init__(self, key: Any):
+        self.key = key
+        self.future: concurrent.futures.Future = concurrent.futures.Future()
+        self.task: Optional[asyncio.Task] = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    Coalesce concurrent calls that share a key into one in-flight run. Every caller gets
+    the run's result, or its exception re-raised. The shared outcome lives in a
+    concurrent.futures.Future, so callers on different event loops can join the same run.
+    The run is reference counted: a cancelled caller only stops waiting, and the run itself
+    is cancelled once every caller has gone.
+    """
+
+    def __init__(self):
+        self._inflight: Dict[Any, _Flight] = {}
+        self._lock = threading.Lock()
+
+    async def do(
+        self,
+        key: Any,
+        fn: Callable[[], Any],
+        on_join: Optional[Callable[[], None]] = None
+    ) -> Tuple[Any, bool]:
+        """Await fn() once per key; returns (result, joined) where joined is False for the leader."""
+        with self._lock:
+            flight = self._inflight.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._inflight[key] = _Flight(key)
+            flight.waiters += 1
+        if leader:
+            # The run gets its own task on the leader's loop so it can outlive the leader
+            flight.task = asyncio.ensure_future(self._run(flight, fn))
+        elif on_join:
+            on_join()
+        try:
+            # Shielded: one caller giving up must not cancel the shared run
+            result = await asyncio.shield(asyncio.wrap_future(flight.future))
+        except asyncio.CancelledError:
+            self._leave(flight)
+            raise
+        return result, not leader
+
+    async def _run(self, flight: _Flight, fn: Callable[[], Any]) -> None:
+        try:
+            result = await fn()
+        except asyncio.CancelledError:
+            flight.future.cancel()
+            raise
+        except BaseException as e:
+            flight.future.set_exception(e)
+        else:
+            flight.future.set_result(result)
+        finally:
+            with self._lock:
+                if self._inflight.get(flight.key) is flight:
+                    del self._inflight[flight.key]
+
+    def _leave(self, flight: _Flight) -> None:
+        with self._lock:
+            flight.waiters -= 1
+            abandoned = flight.waiters == 0
+            if abandoned and self._inflight.get(flight.key) is flight:
+                # New callers start a fresh run instead of joining one being cancelled
+                del self._inflight[flight.key]
+        task = flight.task
+        if abandoned and task is not None and not task.done():
+            task.get_loop().call_soon_threadsafe(task.cancel)
+
+    def __len__(self) -> int:
+        return len(self._inflight)
+
+
+generation_flights = SingleFlight()
+agent_builds = SingleFlight()
+
+
+# -----------------------------
+# Retries and Circuit Breakers
+# -----------------------------
+
+RETRY_MAX_ATTEMPTS = 3
+RETRY_BASE_DELAY = 0.5
+RETRY_MAX_DELAY = 8.0
+# Longest Retry-After a 429 may ask for before the call gives up instead of waiting
+RETRY_MAX_RATE_LIMIT_DELAY = 20.0
+BREAKER_FAILURE_THRESHOLD = 5
+BREAKER_RESET_TIMEOUT = 30.0
+
+_RATE_LIMIT_RE = re.compile(
+    r"\b429\b|too many requests|rate.?limit|resource.?exhausted|exceeded your current quota",
+    flags=re.IGNORECASE,
+)
+_DAILY_QUOTA_RE = re.compile(r"quotaExceeded|dailyLimitExceeded", flags=re.IGNORECASE)
+_TRANSIENT_STATUS_CODES = {408, 425, 429, 500, 502, 503, 504}
+_TRANSIENT_ERROR_RE = re.compile(
+    r"\b(?:408|500|502|503|504)\b|timed? ?out|temporarily unavailable|service unavailable|"
+    r"connection (?:reset|refused|closed|error)|server disconnected",
+    flags=re.IGNORECASE,
+)
+_TRANSIENT_TYPE_RE = re.compile(
+    r"Timeout|Connect|RemoteProtocol|ReadError|WriteError|NetworkError|ServiceUnavailable|"
+    r"DeadlineExceeded|InternalServerError|ResourceExhausted|TooManyRequests|ClosedResource|BrokenResource"
+)
+_RETRY_AFTER_RE = re.compile(r"retry(?:[ _-]?after|[ _-]?delay| in)\W{0,4}(\d+(?:\.\d+)?)", flags=re.IGNORECASE)
+
+
+class CircuitOpenError(RuntimeError):
+    """Raised instead of calling an endpoint whose circuit breaker is open."""
+
+    def __init__(self, label: str, retry_in: float, reason: str):
+        super().__init__(f"{label} is temporarily unavailable ({reason}); retry in {int(retry_in) + 1}s")
+        self.label = label
+        self.retry_in = retry_in
+        self.reason = reason
+
+
+class CircuitBreaker:
+    """
+    Breaker for one endpoint. After failure_threshold consecutive failures it opens and calls
+    fail fast for reset_timeout seconds. Then it is half-open: the next call goes through, a
+    success closes it and a failure opens it again straight away.
+    """
+
+    def __init__(
+        self,
+        label: str,
+        failure_threshold: int = BREAKER_FAILURE_THRESHOLD,
+        reset_timeout: float = BREAKER_RESET_TIMEOUT
+    ):
+        self.label = label
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.open_until = 0.0
+        self.reason = ""
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self.open_until > time.time():
+            return "open"
+        return "half_open" if self.failures >= self.failure_threshold else "closed"
+
+    def check(self) -> None:
+        remaining = self.open_until - time.time()
+        if remaining > 0:
+            raise CircuitOpenError(self.label, remaining, self.reason)
+
+    def record_success(self) -> None:
+        with self._lock:
+            # A late success from a call started before the breaker opened does not close it
+            if self.open_until <= time.time():
+                self.failures = 0
+                self.reason = ""
+
+    def record_failure(self, reason: str) -> None:
+        with self._lock:
+            self.failures += 1
+            self.reason = reason
+            if self.failures >= self.failure_threshold:
+                self.open_until = time.time() + self.reset_timeout
+                print(f"Circuit opened for {self.label} for {int(self.reset_timeout)}s: {reason}")
+
+    def trip(self, reason: str, open_for: float) -> None:
+        """Open the breaker for open_for seconds regardless of the failure count."""
+        with self._lock:
+            self.failures = max(self.failures, self.failure_threshold)
+            self.reason = reason
+            self.open_until = max(self.open_until, time.time() + open_for)
+        print(f"Circuit opened for {self.label} for {int(open_for)}s: {reason}")
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(endpoint: str, label: Optional[str] = None) -> CircuitBreaker:
+    """The shared breaker for an endpoint (an MCP server URL or "gemini:<model>")."""
+    with _breakers_lock:
+        breaker = _breakers.get(endpoint)
+        if breaker is None:
+            breaker = _breakers[endpoint] = CircuitBreaker(label or endpoint)
+        return breaker
+
+
+def _exception_chain(exc: BaseException) -> Iterator[BaseException]:
+    """The exception, its causes and exception-group members (MCP errors arrive inside task groups)."""
+    stack: List[Optional[BaseException]] = [exc]
+    seen = set()
+    while stack:
+        err = stack.pop()
+        if err is None or id(err) in seen:
+            continue
+        seen.add(id(err))
+        yield err
+        stack.extend(getattr(err, "exceptions", None) or ())
+        stack.append(err.__cause__)
+
+
+def _status_code(err: BaseException) -> Optional[int]:
+    for obj in (err, getattr(err, "response", None)):
+        for attr in ("status_code", "code"):
+            code = getattr(obj, attr, None)
+            if isinstance(code, int) and 100 <= code < 600:
+                return code
+    return None
+
+
+def classify_error(exc: BaseException) -> Optional[str]:
+    """
+    "rate_limit", "transient" or "quota" (a daily quota, not worth retrying today).
+    Returns None for errors a retry would not fix, such as bad keys or invalid arguments.
+    """
+    kinds = set()
+    for err in _exception_chain(exc):
+        if isinstance(err, CircuitOpenError):
+            return None
+        text = f"{type(err).__name__}: {err}"
+        code = _status_code(err)
+        if _DAILY_QUOTA_RE.search(text):
+            return "quota"
+        if code == 429 or _RATE_LIMIT_RE.search(text):
+            kinds.add("rate_limit")
+        elif (
+            code in _TRANSIENT_STATUS_CODES
+            or isinstance(err, (TimeoutError, asyncio.TimeoutError, ConnectionError))
+            or _TRANSIENT_TYPE_RE.search(type(err).__name__)
+            or _TRANSIENT_ERROR_RE.search(str(err))
+        ):
+            kinds.add("transient")
+    if "rate_limit" in kinds:
+        return "rate_limit"
+    return "transient" if kinds else None
+
+
+def _retry_after(exc: BaseException) -> Optional[float]:
+    """Server-requested wait in seconds, from a Retry-After header or a "retry in Ns" message."""
+    for err in _exception_chain(exc):
+        headers = getattr(getattr(err, "response", None), "headers", None) or {}
+        try:
+            value = headers.get("retry-after") or headers.get("Retry-After")
+            if value is not None:
+                return float(value)
+        except (TypeError, ValueError):
+            pass
+        match = _RETRY_AFTER_RE.search(str(err))
+        if match:
+            return float(match.group(1))
+    return None
+
+
+def _after_failure(
+    breaker: CircuitBreaker,
+    exc: BaseException,
+    attempt: int,
+    max_attempts: int,
+    idempotent: bool
+) -> Optional[float]:
+    """Record a failed call on its breaker; return the wait before the next attempt, or None to give up."""
+    kind = classify_error(exc)
+    if kind is None:
+        return None
+    if kind == "quota":
+        breaker.trip("quota exhausted", SERVER_UNHEALTHY_TTL)
+        return None
+    breaker.record_failure(f"{kind}: {exc}"[:200])
+    # A 429 was rejected outright, so even a non-idempotent call is safe to repeat
+    if attempt >= max_attempts or breaker.state == "open" or (kind != "rate_limit" and not idempotent):
+        return None
+    if kind == "rate_limit":
+        hinted = _retry_after(exc)
+        if hinted is not None:
+            return hinted + random.uniform(0, RETRY_BASE_DELAY) if hinted <= RETRY_MAX_RATE_LIMIT_DELAY else None
+        ceiling = min(RETRY_MAX_DELAY, 4 * RETRY_BASE_DELAY * 2 ** (attempt - 1))
+    else:
+        ceiling = min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** (attempt - 1))
+    # Equal jitter: concurrent callers hitting the same failure spread out their retries
+    return ceiling / 2 + random.uniform(0, ceiling / 2)
+
+
+async def call_with_retry(
+    endpoint: str,
+    make_call: Callable[[], Any],
+    label: Optional[str] = None,
+    max_attempts: int = RETRY_MAX_ATTEMPTS,
+    idempotent: bool = True
+) -> Any:
+    """
+    Await make_call() through the endpoint's circuit breaker. Transient failures are retried
+    with exponential backoff and jitter. A 429 waits for the server's Retry-After when one is
+    given. Non-idempotent calls are only retried on 429. Raises CircuitOpenError without
+    calling when the breaker is open.
+    """
+    breaker = get_breaker(endpoint, label)
+    attempt = 1
+    while True:
+        breaker.check()
+        try:
+            result = await make_call()
+        except Exception as e:
+            delay = _after_failure(breaker, e, attempt, max_attempts, idempotent)
+            if delay is None:
+                raise
+        else:
+            breaker.record_success()
+            return result
+        await asyncio.sleep(delay)
+        attempt += 1
+
+
+class ResilientChatGoogleGenerativeAI(ChatGoogleGenerativeAI):
+    """
+    ChatGoogleGenerativeAI whose API calls go through call_with_retry, with one breaker per
+    model and API key, so one key's rate limits or exhausted quota never block other users.
+    """
+
+    def _breaker_endpoint(self) -> str:
+        key = self.google_api_key
+        secret = key.get_secret_value() if hasattr(key, "get_secret_value") else (key or "")
+        return f"gemini:{self.model}:{api_key_fingerprint(secret)}"
+
+    async def _agenerate(self, messages: Any, stop: Any = None, run_manager: Any = None, **kwargs: Any) -> Any:
+        generate = super()._agenerate
+        return await call_with_retry(
+            self._breaker_endpoint(),
+            lambda: generate(messages, stop=stop, run_manager=run_manager, **kwargs),
+            label=self.model
+        )
+
+    async def _astream(self, messages: Any, stop: Any = None, run_manager: Any = None, **kwargs: Any) -> Any:
+        # Retried only until the first chunk arrives; a stream that breaks midway is not replayed
+        stream = super()._astream
+        breaker = get_breaker(self._breaker_endpoint(), self.model)
+        attempt = 1
+        while True:
+            breaker.check()
+            received = False
+            try:
+                async for chunk in stream(messages, stop=stop, run_manager=run_manager, **kwargs):
+                    received = True
+                    yield chunk
+            except Exception as e:
+                delay = _after_failure(breaker, e, attempt, RETRY_MAX_ATTEMPTS, not received)
+                if received or delay is None:
+                    raise
+            else:
+                breaker.record_success()
+                return
+            await asyncio.sleep(delay)
+            attempt += 1
+
+
+# -----------------------------
+# Tool Server Health
+# -----------------------------
+
+# Tool server health is the state of each server's circuit breaker, keyed by server URL
+SERVER_UNHEALTHY_TTL = 10 * 60
+_QUOTA_ERROR_RE = re.compile(
+    r"quotaExceeded|dailyLimitExceeded|rateLimitExceeded|exceeded your quota|quota (?:has been )?exceeded",
+    flags=re.IGNORECASE,
+)
+
+
+def mark_server_unhealthy(server_url: str, reason: str, ttl: Optional[float] = None) -> None:
+    """Treat a tool server as unavailable for ttl seconds (SERVER_UNHEALTHY_TTL by default)."""
+    get_breaker(server_url).trip(reason, SERVER_UNHEALTHY_TTL if ttl is None else ttl)
+
+
+def is_server_healthy(server_url: Optional[str]) -> bool:
+    if not server_url:
+        return False
+    return get_breaker(server_url).state != "open"
+
+
+def unhealthy_server_reason(server_url: Optional[str]) -> str:
+    """Why a tool server is treated as unavailable, for showing next to a fallback result."""
+    if not server_url:
+        return "no server URL configured"
+    breaker = get_breaker(server_url)
+    return (breaker.reason if breaker.state == "open" else "") or "tool setup failed"
+
+
+# Set for background work (agent prefetch): its failures are logged, and never mark a server
+# unhealthy, so a flaky prefetch cannot send the user's next run down the direct fallback
+_background_run: "contextvars.ContextVar[bool]" = contextvars.ContextVar("background_run", default=False)
+
+
+# Result _wrap_tool hands the agent in place of a tool that stayed unavailable
+_TOOL_FALLBACK_RE = re.compile(r"^Tool \S+ is unavailable right now")
+
+
+def _is_degraded_tool_output(text: str) -> bool:
+    """A tool result that stands in for real data: an unavailable-tool fallback or a quota notice."""
+    return bool(_TOOL_FALLBACK_RE.match(text) or _QUOTA_ERROR_RE.search(text))
+
+
+def _mark_degraded_run(result: dict) -> dict:
+    """
+    Flag ("degraded") a run in which the agent carried on without a tool, so its links may be
+    guessed; like direct results, such runs are not written to the response cache.
+    """
+    for msg in (result or {}).get("messages") or []:
+        if getattr(msg, "type", "") == "tool" and _is_degraded_tool_output(_tool_output_text(getattr(msg, "content", ""))):
+            result["degraded"] = True
+            break
+    return result
+
+
+def _record_tool_quota_errors(result: dict, youtube_pipedream_url: str) -> None:
+    """Mark the YouTube server unhealthy when a run's tool results report an exhausted quota."""
+    for msg in (result or {}).get("messages") or []:
+        if getattr(msg, "type", "") != "tool":
+            continue
+        content = getattr(msg, "content", "")
+        text = content if isinstance(content, str) else json.dumps(content, default=str)
+        if _QUOTA_ERROR_RE.search(text) and "youtube" in (f"{getattr(msg, 'name', '')} {text}").lower():
+            mark_server_unhealthy(youtube_pipedream_url, "YouTube quota exhausted")
+            return
+
+
+# -----------------------------
+# MCP Tool Schema Cache
+# -----------------------------
+
+# Cached schemas are revalidated in the background at most once per interval per server
+TOOL_SCHEMA_REVALIDATE_INTERVAL = 5 * 60
+
+# Strong references to in-flight revalidation tasks so they are not garbage collected
+_revalidation_tasks: set = set()
+_revalidating_urls: set = set()
+# time.monotonic() of the last revalidation started per server URL
+_last_revalidated: Dict[str, float] = {}
+
+
+def _tool_schema_path(server_url: str) -> str:
+    digest = hashlib.sha256(server_url.encode("utf-8")).hexdigest()[:24]
+    return os.path.join(DATA_DIR, "tool_schemas", f"{digest}.json")
+
+
+def _tool_schema_hash(tool_defs: List[Dict[str, Any]]) -> str:
+    canonical = json.dumps(sorted(tool_defs, key=lambda d: d.get("name", "")), sort_keys=True)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def load_cached_tool_schemas(server_url: str) -> Optional[Dict[str, Any]]:
+    """Return the cached {"url", "schema_hash", "fetched_at", "tools"} record for a server, if any."""
+    path = _tool_schema_path(server_url)
+    if not os.path.isfile(path):
+        return None
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            record = json.load(f)
+    except Exception:
+        return None
+    if record.get("url") != server_url or not isinstance(record.get("tools"), list):
+        return None
+    return record
+
+
+def save_cached_tool_schemas(server_url: str, tool_defs: List[Dict[str, Any]]) -> str:
+    """Persist discovered tool definitions for a server and return their schema hash."""
+    schema_hash = _tool_schema_hash(tool_defs)
+    path = _tool_schema_path(server_url)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    record = {
+        "url": server_url,
+        "schema_hash": schema_hash,
+        "fetched_at": datetime.now().isoformat(timespec="seconds"),
+        "tools": tool_defs,
+    }
+    tmp_path = path + ".tmp"
+    try:
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(record, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+    except Exception as e:
+        print(f"Could not cache tool schemas: {e}")
+    return schema_hash
+
+
+async def _fetch_tool_definitions(mcp_client: MultiServerMCPClient, server_name: str) -> List[Dict[str, Any]]:
+    """List every tool a server exposes and return the raw MCP definitions as JSON dicts."""
+    async def _list_all() -> List[Dict[str, Any]]:
+        tool_defs: List[Dict[str, Any]] = []
+        async with mcp_client.session(server_name) as session:
+            cursor = None
+            while True:
+                page = await session.list_tools(cursor=cursor)
+                tool_defs.extend(t.model_dump(mode="json", exclude_none=True) for t in page.tools)
+                cursor = page.nextCursor
+                if not cursor:
+                    break
+        return tool_defs
+
+    return await call_with_retry(mcp_client.connections[server_name]["url"], _list_all, label=server_name)
+
+
+def _tools_from_definitions(
+    tool_defs: List[Dict[str, Any]],
+    connection: Dict[str, Any],
+    server_name: str
+) -> List[Any]:
+    # session=None: each tool call opens its own session from the connection config
+    tools = [
+        convert_mcp_tool_to_langchain_tool(None, MCPTool.model_validate(d), connection=connection)
+        for d in tool_defs
+    ]
+    return wrap_mcp_tools(server_name, tools, server_url=connection.get("url"))
+
+
+async def _revalidate_tool_schemas(mcp_client: MultiServerMCPClient, server_name: str, known_hash: str) -> None:
+    server_url = mcp_client.connections[server_name]["url"]
+    try:
+        tool_defs = await _fetch_tool_definitions(mcp_client, server_name)
+        if _tool_schema_hash(tool_defs) != known_hash:
+            save_cached_tool_schemas(server_url, tool_defs)
+            dropped = agent_pool.invalidate_url(server_url)
+            print(f"Tool list changed for '{server_name}', dropped {dropped} pooled agent(s)")
+    except Exception as e:
+        print(f"Tool schema revalidation failed for '{server_name}': {e}")
+    finally:
+        _revalidating_urls.discard(server_url)
+
+
+async def load_server_tools(mcp_client: MultiServerMCPClient, server_name: str) -> List[Any]:
+    """
+    Return LangChain tools for one MCP server. Cached schemas are used straight away and
+    revalidated in the background (at most every TOOL_SCHEMA_REVALIDATE_INTERVAL seconds);
+    only a cold cache waits on tool discovery.
+    """
+    connection = mcp_client.connections[server_name]
+    server_url = connection["url"]
+    cached = load_cached_tool_schemas(server_url)
+    if cached is not None:
+        now = time.monotonic()
+        recent = now - _last_revalidated.get(server_url, float("-inf")) < TOOL_SCHEMA_REVALIDATE_INTERVAL
+        if server_url not in _revalidating_urls and not recent:
+            _revalidating_urls.add(server_url)
+            _last_revalidated[server_url] = now
+            task = asyncio.get_running_loop().create_task(
+                _revalidate_tool_schemas(mcp_client, server_name, cached["schema_hash"])
+            )
+            _revalidation_tasks.add(task)
+            task.add_done_callback(_revalidation_tasks.discard)
+        return _tools_from_definitions(cached["tools"], connection, server_name)
+
+    try:
+        tool_defs = await _fetch_tool_definitions(mcp_client, server_name)
+    except CircuitOpenError:
+        raise
+    except Exception as e:
+        if not _background_run.get():
+            mark_server_unhealthy(server_url, f"tool discovery failed for '{server_name}': {e}")
+        raise
+    save_cached_tool_schemas(server_url, tool_defs)
+    return _tools_from_definitions(tool_defs, connection, server_name)
+
+
+async def load_all_tools(mcp_client: MultiServerMCPClient) -> List[Any]:
+    """Load tools for every configured server concurrently, via the schema cache."""
+    per_server = await asyncio.gather(
+        *(load_server_tools(mcp_client, name) for name in mcp_client.connections)
+    )
+    return [tool for tools in per_server for tool in tools]
+
+
+# -----------------------------
+# MCP Tool Wrapping
+# -----------------------------
+
+# Servers whose read-only tools may be cached, and how read-only tools are recognised by the
+# words of their name ("youtube-search_videos", "getVideoDetails"), not by substrings
+CACHEABLE_TOOL_SERVERS = {"youtube"}
+_READ_ONLY_TOOL_WORDS = {"search", "list", "get", "details", "info", "find"}
+_MUTATING_TOOL_WORDS = {
+    "create", "upload", "update", "delete", "insert", "add", "rate", "subscribe", "comment", "reply", "edit", "remove"
+}
+_TOOL_NAME_WORD_RE = re.compile(r"[A-Z]+(?![a-z])|[A-Z]?[a-z]+|\d+")
+# Argument names whose values are free-text queries, in order of preference; matched case-insensitively
+_QUERY_ARG_NAMES = ("q", "query", "search_query", "searchquery", "keyword", "keywords", "term")
+
+tool_result_cache = TTLCache(max_size=5000, ttl=6 * 3600, refresh_on_access=False)
+tool_cache_stats: Dict[str, int] = {"hits": 0, "misses": 0}
+
+
+def _tool_name_words(tool_name: str) -> Set[str]:
+    """Lower-cased words of a tool name, split on separators and camelCase."""
+    return {w.lower() for w in _TOOL_NAME_WORD_RE.findall(tool_name)}
+
+
+def is_mutating_tool(tool_name: str) -> bool:
+    return bool(_tool_name_words(tool_name) & _MUTATING_TOOL_WORDS)
+
+
+def is_read_only_tool(tool_name: str) -> bool:
+    words = _tool_name_words(tool_name)
+    return bool(words & _READ_ONLY_TOOL_WORDS) and not words & _MUTATING_TOOL_WORDS
+
+
+def is_cacheable_tool(server_name: str, tool_name: str) -> bool:
+    return server_name in CACHEABLE_TOOL_SERVERS and is_read_only_tool(tool_name)
+
+
+def _canonical_tool_args(args: Dict[str, Any]) -> str:
+    def _canon(name: str, value: Any) -> Any:
+        if isinstance(value, str):
+            value = " ".join(value.split())
+            return value.casefold() if name.casefold() in _QUERY_ARG_NAMES else value
+        if isinstance(value, dict):
+            return {k: _canon(k, v) for k, v in value.items()}
+        if isinstance(value, list):
+            return [_canon(name, v) for v in value]
+        return value
+
+    canonical = {k: _canon(k, v) for k, v in args.items() if v is not None}
+    return json.dumps(canonical, sort_keys=True, separators=(",", ":"), default=str)
+
+
+def compact_youtube_output(text: str) -> Optional[str]:
+    """
+    Compact a YouTube search/video-details result to one small JSON record per video
+    (id, title, channel, duration, views). Returns None when no videos are recognised.
+    """
+    videos = extract_youtube_videos(text)
+    if not videos:
+        return None
+    records = [{k: v for k, v in video.items() if v} for video in videos]
+    return json.dumps(records, ensure_ascii=False, separators=(",", ":"))
+
+
+# Output post-processors, first match wins: (server name, tool name regex, compactor).
+# A compactor takes the tool's text output and returns a compact replacement or None.
+TOOL_OUTPUT_COMPACTORS: List[Tuple[str, str, Callable[[str], Optional[str]]]] = [
+    ("youtube", r"search|video|list", compact_youtube_output),
+]
+tool_compaction_stats: Dict[str, int] = {"calls": 0, "bytes_before": 0, "bytes_after": 0}
+
+
+def _approx_tokens(num_bytes: int) -> int:
+    # ~4 bytes per token for English/JSON text
+    return (num_bytes + 3) // 4
+
+
+def get_tool_compaction_stats() -> Dict[str, Any]:
+    """Byte and estimated token savings from tool output compaction since process start."""
+    stats = dict(tool_compaction_stats)
+    saved = stats["bytes_before"] - stats["bytes_after"]
+    stats["bytes_saved"] = saved
+    stats["tokens_before_est"] = _approx_tokens(stats["bytes_before"])
+    stats["tokens_after_est"] = _approx_tokens(stats["bytes_after"])
+    stats["tokens_saved_est"] = stats["tokens_before_est"] - stats["tokens_after_est"]
+    stats["saved_pct"] = round(100.0 * saved / stats["bytes_before"], 1) if stats["bytes_before"] else 0.0
+    return stats
+
+
+def _find_compactor(server_name: str, tool_name: str) -> Optional[Callable[[str], Optional[str]]]:
+    for server, pattern, compactor in TOOL_OUTPUT_COMPACTORS:
+        if server == server_name and re.search(pattern, tool_name, flags=re.IGNORECASE):
+            return compactor
+    return None
+
+
+def _compact_tool_output(output: Any, compactor: Callable[[str], Optional[str]]) -> Any:
+    text = _tool_output_text(output)
+    try:
+        compact = compactor(text)
+    except Exception as e:
+        print(f"Tool output compaction failed: {e}")
+        compact = None
+    if compact is None or len(compact) >= len(text):
+        return output
+    tool_compaction_stats["calls"] += 1
+    tool_compaction_stats["bytes_before"] += len(text.encode("utf-8"))
+    tool_compaction_stats["bytes_after"] += len(compact.encode("utf-8"))
+    if isinstance(output, tuple) and output:
+        # content_and_artifact tools: keep the artifact, replace only what the model sees
+        return (compact,) + tuple(output[1:])
+    return compact
+
+
+def _wrap_tool(
+    tool: Any,
+    cache: bool,
+    compactor: Optional[Callable[[str], Optional[str]]],
+    server_name: str = "",
+    server_url: Optional[str] = None
+) -> Any:
+    """
+    Copy of an MCP tool whose output is compacted (when a compactor applies) and whose
+    successful results are served from tool_result_cache (when cache is set). With server_url,
+    calls go through call_with_retry; when the server stays unavailable the agent gets a short
+    error result instead of the run failing.
+    """
+    call_tool = tool.coroutine
+    idempotent = not is_mutating_tool(tool.name)
+
+    async def _wrapped_call(**arguments: Any) -> Any:
+        key = (tool.name, _canonical_tool_args(arguments))
+        if cache:
+            hit = tool_result_cache.get(key)
+            if hit is not None:
+                tool_cache_stats["hits"] += 1
+                return hit
+            tool_cache_stats["misses"] += 1
+        if server_url:
+            try:
+                output = await call_with_retry(
+                    server_url, lambda: call_tool(**arguments), label=server_name or tool.name, idempotent=idempotent
+                )
+            except Exception as e:
+                if not isinstance(e, CircuitOpenError) and classify_error(e) is None:
+                    raise
+                # Let the agent carry on without this tool rather than failing the whole run;
+                # _TOOL_FALLBACK_RE recognises this message so the run is not cached
+                message = f"Tool {tool.name} is unavailable right now ({e}). Continue without it."
+                return (message, None) if getattr(tool, "response_format", "") == "content_and_artifact" else message
+        else:
+            output = await call_tool(**arguments)
+        # Quota notices returned as content are neither compacted away nor cached
+        if _QUOTA_ERROR_RE.search(_tool_output_text(output)):
+            return output
+        if compactor is not None:
+            output = _compact_tool_output(output, compactor)
+        # Errors raise ToolException and never reach the cache
+        if cache:
+            tool_result_cache.set(key, output)
+        return output
+
+    return tool.model_copy(update={"coroutine": _wrapped_call})
+
+
+def wrap_mcp_tools(server_name: str, tools: List[Any], server_url: Optional[str] = None) -> List[Any]:
+    """
+    Post-process tools for one server before they reach an agent: outputs matched by
+    TOOL_OUTPUT_COMPACTORS are compacted before re-entering the agent context, and
+    read-only tools of CACHEABLE_TOOL_SERVERS get a shared, TTL- and size-bounded result
+    cache keyed by tool name plus canonicalized arguments. With server_url, every call is
+    retried and circuit-broken per server.
+    """
+    wrapped = []
+    for tool in tools:
+        if getattr(tool, "coroutine", None) is not None:
+            cache = is_cacheable_tool(server_name, tool.name)
+            compactor = _find_compactor(server_name, tool.name)
+            if cache or compactor is not None or server_url:
+                tool = _wrap_tool(tool, cache, compactor, server_name, server_url)
+        wrapped.append(tool)
+    return wrapped
+
+
+# -----------------------------
+# Agent Context Management
+# -----------------------------
+
+# Approximate token ceiling for what the model sees on each agent turn
+CONTEXT_TOKEN_CEILING = 24000
+# Tool results newer than this many are passed through verbatim (unless over the ceiling)
+KEEP_RECENT_TOOL_RESULTS = 4
+
+
+def _summarize_tool_message(msg: Any) -> Any:
+    """Replace a tool result with a one-line stub that keeps the videos it found."""
+    videos = extract_youtube_videos(getattr(msg, "content", ""))
+    if videos:
+        found = "; ".join(f"{v['id']} {v.get('title', '')}".strip() for v in videos[:5])
+        stub = f"[Earlier {getattr(msg, 'name', None) or 'tool'} result trimmed. Videos: {found}]"
+    else:
+        stub = f"[Earlier {getattr(msg, 'name', None) or 'tool'} result trimmed]"
+    if len(stub) >= len(_tool_output_text(getattr(msg, "content", ""))):
+        return msg
+    return msg.model_copy(update={"content": stub})
+
+
+def make_context_policy(
+    token_ceiling: int = CONTEXT_TOKEN_CEILING,
+    keep_recent_tool_results: int = KEEP_RECENT_TOOL_RESULTS
+) -> Callable[[Dict[str, Any]], Dict[str, Any]]:
+    """
+    Build a pre_model_hook that trims what the model sees without touching the graph state.
+    The prompt and every AI turn (the plan, the chosen videos, all tool calls) are kept.
+    Tool results older than the newest keep_recent_tool_results become short stubs that
+    still list the videos found. If the context is still over token_ceiling, newer tool
+    results are stubbed too, oldest first. Tool call/result pairing is never broken.
+    """
+    def context_policy(state: Dict[str, Any]) -> Dict[str, Any]:
+        messages = list(state.get("messages") or [])
+        tool_positions = [i for i, m in enumerate(messages) if getattr(m, "type", "") == "tool"]
+        split = max(0, len(tool_positions) - keep_recent_tool_results)
+        for i in tool_positions[:split]:
+            messages[i] = _summarize_tool_message(messages[i])
+        total = count_tokens_approximately(messages)
+        for i in tool_positions[split:]:
+            if total <= token_ceiling:
+                break
+            before = count_tokens_approximately([messages[i]])
+            messages[i] = _summarize_tool_message(messages[i])
+            total -= before - count_tokens_approximately([messages[i]])
+        return {"llm_input_messages": messages}
+
+    return context_policy
+
+
+# -----------------------------
+# Model Routing
+# -----------------------------
+
+# Model name and generation parameters (ChatGoogleGenerativeAI kwargs) per pipeline stage
+DEFAULT_MODEL_ROUTES: Dict[str, Dict[str, Any]] = {
+    # Full ReAct generation: plans, searches and writes in one loop, keeps the stronger model
+    "agent": {"model": "gemini-2.5-flash"},
+    # Single-call generation without tools
+    "direct": {"model": "gemini-2.5-flash"},
+    # Day/topic plan as structured data
+    "planning": {"model": "gemini-2.5-flash-lite", "temperature": 0.2},
+    # Picking the best video among a handful of search results
+    "video_selection": {"model": "gemini-2.5-flash-lite", "temperature": 0.0},
+    # Practice questions, where wording quality matters most
+    "question_writing": {"model": "gemini-2.5-flash", "temperature": 0.7},
+    # Drive upload orchestration: a single tool call and a confirmation line
+    "upload": {"model": "gemini-2.5-flash-lite", "temperature": 0.0},
+}
+MODEL_ROUTES: Dict[str, Dict[str, Any]] = {stage: dict(route) for stage, route in DEFAULT_MODEL_ROUTES.items()}
+
+
+def configure_model_routes(overrides: Dict[str, Dict[str, Any]], reset: bool = False) -> None:
+    """
+    Update per-stage routes, e.g. {"planning": {"model": "gemini-2.5-flash", "temperature": 0}}.
+    Pooled agents are dropped so the next run picks up the new models.
+    """
+    if reset:
+        MODEL_ROUTES.clear()
+        MODEL_ROUTES.update({stage: dict(route) for stage, route in DEFAULT_MODEL_ROUTES.items()})
+    for stage, route in overrides.items():
+        MODEL_ROUTES.setdefault(stage, {}).update(route)
+    agent_pool.clear()
+
+
+# Model instances by (key fingerprint, route, event loop), so their API clients and connections are reused
+_model_instances = TTLCache(max_size=64, ttl=60 * 60)
+
+
+def initialize_model(google_api_key: str, stage: str = "agent") -> ChatGoogleGenerativeAI:
+    """
+    Chat model for a pipeline stage per MODEL_ROUTES. A route with "provider": "scripted"
+    gets the offline ScriptedChatModel (see scripted_chat_model.py) instead of Gemini.
+    """
+    route = dict(MODEL_ROUTES.get(stage) or MODEL_ROUTES["agent"])
+    provider = route.pop("provider", "google")
+    if provider == "google":
+        # Retries happen in call_with_retry, so the client itself makes a single attempt
+        route.setdefault("max_retries", 1)
+    try:
+        loop_id = id(asyncio.get_running_loop())
+    except RuntimeError:
+        loop_id = None
+    key = (api_key_fingerprint(google_api_key), provider, json.dumps(route, sort_keys=True, default=str), loop_id)
+    model = _model_instances.get(key)
+    if model is None:
+        if provider == "scripted":
+            from scripted_chat_model import ScriptedChatModel
+            model = ScriptedChatModel(**route)
+        elif provider == "google":
+            model = ResilientChatGoogleGenerativeAI(
+                google_api_key=google_api_key,
+                **route
+            )
+        else:
+            raise ValueError(f"Unknown model provider for stage {stage!r}: {provider!r}")
+        _model_instances.set(key, model)
+    return model
+
+
+# -----------------------------
+# Checkpointed Runs
+# -----------------------------
+
+class ResumableGenerationError(RuntimeError):
+    """A checkpointed generation failed; pass thread_id back to resume it from its last completed step."""
+
+    def __init__(self, thread_id: str, cause: BaseException):
+        super().__init__(f"{cause} (resumable run {thread_id})")
+        self.thread_id = thread_id
+
+
+# Checkpoints of runs that were never resumed (or finished) are pruned after this many seconds
+CHECKPOINT_TTL = 24 * 3600
+
+# The saver lives on the shared loop only: its aiosqlite connection belongs to the loop that
+# opened it, and savers for callers' own loops would never be closed. (loop, opening task)
+_checkpointer: Optional[Tuple[asyncio.AbstractEventLoop, asyncio.Task]] = None
+_checkpointer_context: Optional[Any] = None
+
+
+async def _open_checkpointer() -> Any:
+    global _checkpointer_context
+    _ensure_data_dir()
+    context = AsyncSqliteSaver.from_conn_string(CHECKPOINT_PATH)
+    saver = await context.__aenter__()
+    # Kept open for the life of the shared loop
+    _checkpointer_context = context
+    async with saver.lock:
+        await saver.conn.execute(
+            "CREATE TABLE IF NOT EXISTS run_threads (thread_id TEXT PRIMARY KEY, started_at REAL NOT NULL)"
+        )
+        await saver.conn.commit()
+    await _prune_checkpoints(saver)
+    return saver
+
+
+async def _register_thread(saver: Any, thread_id: str) -> None:
+    """Record when a checkpointed run started, so _prune_checkpoints can expire it."""
+    async with saver.lock:
+        await saver.conn.execute(
+            "INSERT OR REPLACE INTO run_threads (thread_id, started_at) VALUES (?, ?)", (thread_id, time.time())
+        )
+        await saver.conn.commit()
+
+
+async def _prune_checkpoints(saver: Any) -> None:
+    """Delete the checkpoints of runs started more than CHECKPOINT_TTL seconds ago."""
+    try:
+        async with saver.lock:
+            async with saver.conn.execute(
+                "SELECT thread_id FROM run_threads WHERE started_at < ?", (time.time() - CHECKPOINT_TTL,)
+            ) as cursor:
+                expired = [row[0] for row in await cursor.fetchall()]
+        for thread_id in expired:
+            await _delete_thread(saver, thread_id)
+        if expired:
+            print(f"Pruned checkpoints of {len(expired)} expired runs")
+    except Exception as e:
+        print(f"Could not prune checkpoints: {e}")
+
+
+async def _delete_thread(saver: Any, thread_id: str) -> None:
+    await saver.adelete_thread(thread_id)
+    async with saver.lock:
+        await saver.conn.execute("DELETE FROM run_threads WHERE thread_id = ?", (thread_id,))
+        await saver.conn.commit()
+
+
+async def get_checkpointer() -> Optional[Any]:
+    """
+    The SQLite checkpointer at CHECKPOINT_PATH when running on the shared loop. None on any
+    other loop (such runs are not checkpointed) or when langgraph-checkpoint-sqlite is missing.
+    """
+    global _checkpointer
+    if AsyncSqliteSaver is None or not _on_shared_loop():
+        return None
+    loop = asyncio.get_running_loop()
+    if _checkpointer is None or _checkpointer[0] is not loop:
+        _checkpointer = (loop, loop.create_task(_open_checkpointer()))
+    try:
+        return await asyncio.shield(_checkpointer[1])
+    except Exception as e:
+        _checkpointer = None
+        print(f"Checkpointing disabled, could not open {CHECKPOINT_PATH}: {e}")
+        return None
+
+
+def _is_checkpointed(agent: Any) -> bool:
+    return getattr(agent, "checkpointer", None) is not None
+
+
+def _thread_config(thread_id: str) -> RunnableConfig:
+    return RunnableConfig(**cfg, configurable={"thread_id": thread_id})
+
+
+async def _prepare_agent_run(
+    agent: Any,
+    user_goal: str,
+    thread_id: Optional[str] = None
+) -> Tuple[Optional[dict], RunnableConfig, Optional[str]]:
+    """
+    Input, config and thread id for one agent run. A checkpointed agent runs under a new
+    thread id; given the thread_id of a failed run, the input is None so LangGraph resumes
+    from the last completed step instead of replaying earlier LLM and tool turns.
+    """
+    fresh_input = {"messages": [HumanMessage(content=build_learning_path_prompt(user_goal))]}
+    if not _is_checkpointed(agent):
+        return fresh_input, cfg, None
+    if thread_id is None:
+        thread_id = uuid.uuid4().hex
+        await _register_thread(agent.checkpointer, thread_id)
+        return fresh_input, _thread_config(thread_id), thread_id
+    config = _thread_config(thread_id)
+    snapshot = await agent.aget_state(config)
+    if not snapshot.values:
+        raise ValueError(f"No saved generation to resume for run {thread_id}")
+    return None, config, thread_id
+
+
+async def _discard_checkpoint(agent: Any, thread_id: Optional[str]) -> None:
+    """
+    Drop the checkpoints of a finished or cancelled run; only failed runs are kept for
+    resuming, until CHECKPOINT_TTL expires them.
+    """
+    if thread_id is None or not _is_checkpointed(agent):
+        return
+    try:
+        await _delete_thread(agent.checkpointer, thread_id)
+    except Exception as e:
+        print(f"Could not delete checkpoints for run {thread_id}: {e}")
+
+
+# -----------------------------
+# Agent Setup and Generation
+# -----------------------------
+
+async def setup_agent_with_tools(
+    google_api_key: str,
+    youtube_pipedream_url: str,
+    drive_pipedream_url: Optional[str] = None,
+    notion_pipedream_url: Optional[str] = None,
+    progress_callback: Optional[Callable[[str], None]] = None,
+    response_format: Optional[Any] = None
+) -> Any:
+    """
+    Set up the agent with YouTube (mandatory) and optional Drive or Notion tools.
+    With response_format (a pydantic model), the agent ends with a schema-constrained
+    answer in result["structured_response"].
+    """
+    try:
+        if progress_callback:
+            progress_callback("Setting up agent with tools... ✅")
+
+        variant = (response_format.__name__,) if response_format is not None else ()
+        pool_key = AgentPool.make_key(
+            google_api_key, youtube_pipedream_url, drive_pipedream_url, notion_pipedream_url, *variant
+        )
+        agent = agent_pool.get(pool_key)
+        if agent is not None:
+            if progress_callback:
+                progress_callback("Reusing warm agent from pool... ✅")
+                progress_callback("Setup complete! Starting to generate learning path... ✅")
+            return agent
+
+        async def _build_agent() -> Any:
+            tools_config = {
+                "youtube": mcp_connection(youtube_pipedream_url)
+            }
+
+        
+            if drive_pipedream_url:
+                tools_config["drive"] = mcp_connection(drive_pipedream_url)
+                if progress_callback:
+                    progress_callback("Added Google Drive integration... ✅")
+
+        
+            if notion_pipedream_url:
+                tools_config["notion"] = mcp_connection(notion_pipedream_url)
+                if progress_callback:
+                    progress_callback("Added Notion integration... ✅")
+
+            if progress_callback:
+                progress_callback("Initializing MCP client... ✅")
+        
+            mcp_client = MultiServerMCPClient(tools_config)
+        
+            if progress_callback:
+                progress_callback("Getting available tools... ✅")
+        
+            with timed_phase("tool_discovery"):
+                tools = await load_all_tools(mcp_client)
+        
+            if progress_callback:
+                progress_callback("Creating AI agent... ✅")
+        
+            mcp_orch_model = initialize_model(google_api_key)
+            agent = create_react_agent(
+                mcp_orch_model,
+                tools,
+                response_format=response_format,
+                pre_model_hook=make_context_policy(),
+                checkpointer=await get_checkpointer()
+            )
+            agent_pool.put(pool_key, agent)
+            return agent
+
+        def _on_join() -> None:
+            if progress_callback:
+                progress_callback("Waiting for the agent being prepared in the background... ✅")
+
+        # Concurrent setups for the same key (e.g. a prefetch and a click) share one build
+        agent, _ = await agent_builds.do(pool_key, _build_agent, on_join=_on_join)
+        
+        if progress_callback:
+            progress_callback("Setup complete! Starting to generate learning path... ✅")
+        
+        return agent
+    except Exception as e:
+        print(f"Error in setup_agent_with_tools: {str(e)}")
+        raise
+
+
+GENERATION_MODES = ("agent", "fanout", "structured", "direct")
+
+DIRECT_MODE_NOTE = (
+    "\nTool access: no tools are available in this run. Follow the Fallback Instructions and "
+    "write the complete learning path directly, using YouTube links you are confident exist "
+    "or YouTube search result links when unsure."
+)
+
+
+async def _setup_agent_with_healthy_tools(
+    google_api_key: str,
+    youtube_pipedream_url: str,
+    drive_pipedream_url: Optional[str] = None,
+    notion_pipedream_url: Optional[str] = None,
+    progress_callback: Optional[Callable[[str], None]] = None,
+    response_format: Optional[Any] = None
+) -> Any:
+    """
+    setup_agent_with_tools over the currently healthy servers only. An unhealthy Drive or Notion
+    server is left out; returns None when YouTube itself is unusable so the caller goes direct.
+    """
+    for attempt in range(2):
+        if not is_server_healthy(youtube_pipedream_url):
+            if progress_callback:
+                progress_callback("YouTube tools are unavailable, switching to direct generation... ✅")
+            return None
+        for label, url in (("Drive", drive_pipedream_url), ("Notion", notion_pipedream_url)):
+            if url and not is_server_healthy(url) and progress_callback:
+                progress_callback(f"{label} tools are unavailable, continuing without them... ✅")
+        drive_pipedream_url = drive_pipedream_url if is_server_healthy(drive_pipedream_url) else None
+        notion_pipedream_url = notion_pipedream_url if is_server_healthy(notion_pipedream_url) else None
+        try:
+            return await setup_agent_with_tools(
+                google_api_key=google_api_key,
+                youtube_pipedream_url=youtube_pipedream_url,
+                drive_pipedream_url=drive_pipedream_url,
+                notion_pipedream_url=notion_pipedream_url,
+                progress_callback=progress_callback,
+                response_format=response_format
+            )
+        except Exception:
+            # Tool discovery marks the failing server; retry once without it. A build shared with
+            # a background prefetch fails without marking anything, so retry that once as well.
+            if all(is_server_healthy(u) for u in (youtube_pipedream_url, drive_pipedream_url, notion_pipedream_url) if u):
+                if attempt or _background_run.get():
+                    raise
+    return None
+
+
+async def agenerate_direct_learning_path(
+    google_api_key: str,
+    user_goal: str,
+    progress_callback: Optional[Callable[[str], None]] = None,
+    structured: bool = False
+) -> dict:
+    """
+    Direct generation: one ChatGoogleGenerativeAI call with the learning path prompt, no MCP
+    client and no agent loop. With structured, the call is constrained to the LearningPath schema.
+    """
+    model = initialize_model(google_api_key, stage="direct")
+    prompt = build_learning_path_prompt(user_goal) + DIRECT_MODE_NOTE
+    if progress_callback:
+        progress_callback("Generating your learning path...")
+    if structured:
+        raw_messages: List[Any] = []
+        learning_path = await _ainvoke_structured(model, LearningPath, prompt, raw_messages)
+        return attach_learning_path({"messages": raw_messages, "direct": True}, learning_path)
+    message = await model.ainvoke([HumanMessage(content=prompt)])
+    return {"messages": [message], "direct": True}
+
+
+def build_learning_path_prompt(user_goal: str) -> str:
+    return "User Goal: " + user_goal + "\n" + user_goal_prompt
+
+
+def _is_completed_plan_turn(message: Any, expected_days: Optional[int]) -> bool:
+    """
+    True when an AI turn already holds the full plan and only makes read-only tool calls
+    (more searches), so the run can stop without losing work. Turns that also save to Drive
+    or Notion or build a playlist must run their tools, and without a day count in the goal
+    a partial plan cannot be told apart from a complete one.
+    """
+    tool_calls = getattr(message, "tool_calls", None)
+    if not expected_days or not tool_calls:
+        return False
+    if not all(is_read_only_tool(call.get("name") or "") for call in tool_calls):
+        return False
+    return is_learning_path_complete(_chunk_text(message), expected_days)
+
+
+def _completed_plan_message(state: dict, expected_days: Optional[int]) -> bool:
+    """True when the newest message is an AI turn for which _is_completed_plan_turn holds."""
+    messages = (state or {}).get("messages") or []
+    if not messages or getattr(messages[-1], "type", "") != "ai":
+        return False
+    return _is_completed_plan_turn(messages[-1], expected_days)
+
+
+async def _invoke_learning_path_agent(
+    agent: Any,
+    user_goal: str,
+    budget: Optional["RunBudget"] = None,
+    stop_when_complete: bool = True,
+    thread_id: Optional[str] = None
+) -> dict:
+    """
+    Run the agent step by step (LangGraph "values" stream) so a budget can stop it between
+    steps. Returns the final state, or the last state plus "budget_exceeded" when stopped.
+    With stop_when_complete, the run also ends ("early_stopped") as soon as the model emits
+    a complete Day 1..N plan, instead of letting it keep searching (see _is_completed_plan_turn).
+    Checkpointed agents return the run's "thread_id"; a failure then raises
+    ResumableGenerationError, and passing its thread_id back resumes the run.
+    """
+    expected_days = normalize_goal(user_goal)[1]
+    started = time.perf_counter()
+    run_input, config, thread_id = await _prepare_agent_run(agent, user_goal, thread_id)
+    stream = agent.astream(run_input, config=config, stream_mode="values")
+    state: dict = {}
+    input_messages = None
+    try:
+        while True:
+            timeout = budget.remaining_time(started) if budget else None
+            try:
+                state = await asyncio.wait_for(stream.__anext__(), timeout)
+            except StopAsyncIteration:
+                break
+            except asyncio.TimeoutError:
+                state = dict(state, budget_exceeded=f"wall time over {budget.max_wall_time_s}s")
+                break
+            messages = state.get("messages") or []
+            if input_messages is None:
+                # First state is the input (or, when resuming, the saved history)
+                input_messages = len(messages)
+            elif any(getattr(m, "type", "") == "ai" for m in messages[input_messages:]):
+                record_timing("first_token", time.perf_counter() - started, first_only=True)
+            reason = budget.exceeded(collect_usage(state, time.perf_counter() - started)) if budget else None
+            if reason:
+                state = dict(state, budget_exceeded=reason)
+                break
+            if stop_when_complete and _completed_plan_message(state, expected_days):
+                state = dict(state, early_stopped=True)
+                break
+    except asyncio.CancelledError:
+        await stream.aclose()
+        await _discard_checkpoint(agent, thread_id)
+        raise
+    except Exception as e:
+        if thread_id is not None:
+            raise ResumableGenerationError(thread_id, e) from e
+        raise
+    finally:
+        await stream.aclose()
+    await _discard_checkpoint(agent, thread_id)
+    return dict(state, thread_id=thread_id) if thread_id else state
+
+
+async def _generate_learning_path_uncached(
+    google_api_key: str,
+    youtube_pipedream_url: str,
+    drive_pipedream_url: Optional[str],
+    notion_pipedream_url: Optional[str],
+    user_goal: str,
+    progress_callback: Optional[Callable[[str], None]],
+    use_cache: bool,
+    mode: str,
+    budget: Optional["RunBudget"],
+    started: float,
+    thread_id: Optional[str] = None
+) -> dict:
+    """One generation in the given mode, with the direct-mode fallback; no cache lookup or coalescing."""
+    structured = mode == "structured"
+    # Set when the run falls back to direct generation because the tools are unavailable
+    tools_unavailable = None
+    if mode != "direct" and not is_server_healthy(youtube_pipedream_url):
+        if progress_callback:
+            progress_callback("YouTube tools are unavailable, switching to direct generation... ✅")
+        tools_unavailable = unhealthy_server_reason(youtube_pipedream_url)
+        mode = "direct"
+
+    result = None
+    if mode == "fanout":
+        with timed_phase("llm_loop"):
+            result = await agenerate_fanout_learning_path(
+                google_api_key=google_api_key,
+                youtube_pipedream_url=youtube_pipedream_url,
+                user_goal=user_goal,
+                progress_callback=progress_callback
+            )
+    elif mode in ("agent", "structured"):
+        with timed_phase("setup"):
+            agent = await _setup_agent_with_healthy_tools(
+                google_api_key=google_api_key,
+                youtube_pipedream_url=youtube_pipedream_url,
+                drive_pipedream_url=drive_pipedream_url,
+                notion_pipedream_url=notion_pipedream_url,
+                progress_callback=progress_callback,
+                response_format=LearningPath if structured else None
+            )
+        
+        
+        if agent is not None:
+            if progress_callback:
+                progress_callback("Generating your learning path...")
+            
+            with timed_phase("llm_loop"):
+                result = await _invoke_learning_path_agent(
+                    agent, user_goal, budget, stop_when_complete=not structured, thread_id=thread_id
+                )
+            _record_tool_quota_errors(result, youtube_pipedream_url)
+            _mark_degraded_run(result)
+            if structured and not result.get("budget_exceeded"):
+                result = attach_learning_path(result, result.get("structured_response"))
+        else:
+            tools_unavailable = unhealthy_server_reason(youtube_pipedream_url)
+    if result is None:
+        with timed_phase("llm_loop"):
+            result = await agenerate_direct_learning_path(
+                google_api_key=google_api_key,
+                user_goal=user_goal,
+                progress_callback=progress_callback,
+                structured=structured
+            )
+        if tools_unavailable:
+            result["tools_unavailable"] = tools_unavailable
+    result["usage"] = collect_usage(result, time.perf_counter() - started)
+    if result.get("budget_exceeded"):
+        if progress_callback:
+            progress_callback(f"Stopped early: budget exceeded ({result['budget_exceeded']})")
+    elif use_cache and not (result.get("direct") or result.get("degraded")):
+        # The cache is keyed by goal alone; direct or degraded results (model-guessed links, often
+        # during a YouTube outage) would be served to tool-backed requests after it recovers
+        with timed_phase("cache_store"):
+            await _store_learning_path_result(user_goal, result)
+    return result
+
+
+async def agenerate_learning_path(
+    google_api_key: str,
+    youtube_pipedream_url: str,
+    drive_pipedream_url: Optional[str] = None,
+    notion_pipedream_url: Optional[str] = None,
+    user_goal: str = "",
+    progress_callback: Optional[Callable[[str], None]] = None,
+    use_cache: bool = True,
+    mode: str = "agent",
+    budget: Optional["RunBudget"] = None,
+    coalesce: bool = True,
+    thread_id: Optional[str] = None
+) -> dict:
+    """
+    Generate a learning path on the caller's event loop and return the agent state.
+    Safe to run many of these concurrently from one process. With use_cache, a goal that
+    normalizes to a cached one is answered from the response cache without running the agent.
+    mode "agent" runs the ReAct agent; "fanout" runs the plan-then-fan-out pipeline;
+    "structured" runs the agent with a JSON learning path schema (see LearningPath);
+    "direct" makes a single model call without tools. Any mode switches to direct generation
+    while the YouTube server is unhealthy or out of quota.
+    The result carries a "usage" report (see collect_usage); a budget stops the agent loop
+    cleanly once exceeded and the result then carries "budget_exceeded".
+    With coalesce, concurrent calls for the same normalized goal and tool configuration share
+    one in-flight run; joiners get a copy of its result marked "coalesced".
+    Agent runs on the shared loop (run_agent_sync, start_generation) are checkpointed to
+    CHECKPOINT_PATH when langgraph-checkpoint-sqlite is installed.
+    A failed run raises ResumableGenerationError; call again with its thread_id (and the same
+    goal, mode and URLs) to resume from the last completed step, skipping cache and coalescing.
+    The result carries "timings", seconds per phase of this call (see record_timing).
+    """
+    started = time.perf_counter()
+    timings: Dict[str, float] = {}
+    timings_token = _run_timings.set(timings)
+    try:
+        if mode not in GENERATION_MODES:
+            raise ValueError(f"Unknown generation mode: {mode!r} (expected one of {GENERATION_MODES})")
+        if use_cache and thread_id is None:
+            with timed_phase("cache_lookup"):
+                cached = _cached_learning_path_result(
+                    user_goal, progress_callback, require_structure=mode in ("structured", "fanout")
+                )
+            if cached is not None:
+                if mode in ("agent", "structured"):
+                    # The Drive document or Notion page a generation would have created
+                    cached = await _save_cached_result_to_tool(
+                        google_api_key, drive_pipedream_url, notion_pipedream_url, user_goal, cached, progress_callback
+                    )
+                return dict(cached, timings=dict(timings, total=round(time.perf_counter() - started, 4)))
+
+        generate = functools.partial(
+            _generate_learning_path_uncached,
+            google_api_key=google_api_key,
+            youtube_pipedream_url=youtube_pipedream_url,
+            drive_pipedream_url=drive_pipedream_url,
+            notion_pipedream_url=notion_pipedream_url,
+            user_goal=user_goal,
+            progress_callback=progress_callback,
+            use_cache=use_cache,
+            mode=mode,
+            budget=budget,
+            started=started,
+            thread_id=thread_id
+        )
+        if not coalesce or thread_id is not None:
+            result = await generate()
+        else:
+            flight_key = (
+                goal_cache_key(user_goal),
+                mode,
+                youtube_pipedream_url or None,
+                drive_pipedream_url or None,
+                notion_pipedream_url or None,
+                use_cache,
+                tuple(sorted(vars(budget).items())) if budget else None,
+            )
+
+            def _on_join() -> None:
+                if progress_callback:
+                    progress_callback("Joining an identical generation already in progress... ✅")
+
+            result, joined = await generation_flights.do(flight_key, generate, on_join=_on_join)
+            if joined:
+                result = dict(result, coalesced=True)
+        
+        if progress_callback:
+            progress_callback("Learning path generation complete!")
+        
+        return dict(result, timings=dict(timings, total=round(time.perf_counter() - started, 4)))
+    except Exception as e:
+        print(f"Error in agenerate_learning_path: {str(e)}")
+        raise
+    finally:
+        _run_timings.reset(timings_token)
+
+
+def start_generation(
+    google_api_key: str,
+    youtube_pipedream_url: str,
+    drive_pipedream_url: Optional[str] = None,
+    notion_pipedream_url: Optional[str] = None,
+    user_goal: str = "",
+    use_cache: bool = True,
+    mode: str = "agent",
+    budget: Optional["RunBudget"] = None,
+    coalesce: bool = True,
+    thread_id: Optional[str] = None
+) -> RunHandle:
+    """
+    Start agenerate_learning_path on the shared loop and return a RunHandle right away.
+    handle.wait(progress_callback) returns the result; handle.cancel() stops the run.
+    """
+    return submit_coroutine(
+        agenerate_learning_path,
+        relay_progress=True,
+        google_api_key=google_api_key,
+        youtube_pipedream_url=youtube_pipedream_url,
+        drive_pipedream_url=drive_pipedream_url,
+        notion_pipedream_url=notion_pipedream_url,
+        user_goal=user_goal,
+        use_cache=use_cache,
+        mode=mode,
+        budget=budget,
+        coalesce=coalesce,
+        thread_id=thread_id,
+    )
+
+
+def run_agent_sync(
+    google_api_key: str,
+    youtube_pipedream_url: str,
+    drive_pipedream_url: Optional[str] = None,
+    notion_pipedream_url: Optional[str] = None,
+    user_goal: str = "",
+    progress_callback: Optional[Callable[[str], None]] = None,
+    use_cache: bool = True,
+    mode: str = "agent",
+    budget: Optional["RunBudget"] = None,
+    coalesce: bool = True,
+    thread_id: Optional[str] = None
+) -> dict:
+    """
+    Synchronous wrapper for running the agent.
+    """
+    return run_coroutine_sync(
+        agenerate_learning_path,
+        google_api_key=google_api_key,
+        youtube_pipedream_url=youtube_pipedream_url,
+        drive_pipedream_url=drive_pipedream_url,
+        notion_pipedream_url=notion_pipedream_url,
+        user_goal=user_goal,
+        progress_callback=progress_callback,
+        use_cache=use_cache,
+        mode=mode,
+        budget=budget,
+        coalesce=coalesce,
+        thread_id=thread_id,
+    )
+
+
+# -----------------------------
+# Agent Prefetch
+# -----------------------------
+
+_SERVER_URL_RE = re.compile(r"^https?://(?:localhost(?::\d+)?|[^\s/]+\.[^\s/]+)(?:/\S*)?$", flags=re.IGNORECASE)
+# Pending prefetches by (key fingerprint, URLs, mode), so reruns do not resubmit the same work
+_prefetches: Dict[Any, concurrent.futures.Future] = {}
+_prefetches_lock = threading.Lock()
+
+
+def looks_like_server_url(url: Optional[str]) -> bool:
+    return bool(url) and bool(_SERVER_URL_RE.match(url.strip()))
+
+
+async def _warm_tool_schemas(servers: Dict[str, str]) -> None:
+    mcp_client = MultiServerMCPClient(
+        {name: mcp_connection(url) for name, url in servers.items()}
+    )
+    await load_all_tools(mcp_client)
+
+
+async def _run_prefetch(make_coro: Callable[[], Any]) -> None:
+    _background_run.set(True)
+    try:
+        await make_coro()
+    except Exception as e:
+        print(f"Prefetch failed: {e}")
+
+
+def prefetch_agent(
+    google_api_key: Optional[str],
+    youtube_pipedream_url: Optional[str],
+    drive_pipedream_url: Optional[str] = None,
+    notion_pipedream_url: Optional[str] = None,
+    mode: str = "agent"
+) -> Optional[concurrent.futures.Future]:
+    """
+    Start tool discovery and agent setup for these URLs on the shared loop without waiting.
+    A later generation with the same settings then finds a warm pooled agent, or joins the
+    build still in flight. Without a usable API key (or outside the agent modes) only the
+    tool schemas are warmed. URLs that do not look valid are ignored. Repeated calls while a
+    prefetch is pending return the pending future. Failures are logged, not raised.
+    """
+    servers = {
+        name: url.strip()
+        for name, url in (("youtube", youtube_pipedream_url), ("drive", drive_pipedream_url), ("notion", notion_pipedream_url))
+        if looks_like_server_url(url)
+    }
+    if not servers or mode == "direct":
+        return None
+    has_key = bool(google_api_key) and len(google_api_key.strip()) >= 20
+    if mode in ("agent", "structured") and has_key and "youtube" in servers:
+        make_coro = functools.partial(
+            _setup_agent_with_healthy_tools,
+            google_api_key=google_api_key,
+            youtube_pipedream_url=servers["youtube"],
+            drive_pipedream_url=servers.get("drive"),
+            notion_pipedream_url=servers.get("notion"),
+            response_format=LearningPath if mode == "structured" else None
+        )
+    else:
+        if mode == "fanout":
+            # The fan-out pipeline only uses YouTube tools
+            servers = {k: v for k, v in servers.items() if k == "youtube"}
+            if not servers:
+                return None
+        make_coro = functools.partial(_warm_tool_schemas, servers)
+
+    key = (
+        api_key_fingerprint(google_api_key.strip()) if has_key else None,
+        tuple(sorted(servers.items())),
+        mode,
+    )
+    with _prefetches_lock:
+        future = _prefetches.get(key)
+        if future is not None and not future.done():
+            return future
+        future = asyncio.run_coroutine_threadsafe(_run_prefetch(make_coro), get_shared_loop())
+        _prefetches[key] = future
+
+    def _forget(done: concurrent.futures.Future) -> None:
+        with _prefetches_lock:
+            if _prefetches.get(key) is done:
+                del _prefetches[key]
+
+    future.add_done_callback(_forget)
+    return future
+
+
+# -----------------------------
+# Run Timings
+# -----------------------------
+
+# Seconds per phase of the generation running in the current context, if any:
+# cache_lookup, setup (agent and tools), tool_discovery (within setup; cold agents only),
+# first_token (agent loop start to the first model output), llm_loop, cache_store,
+# secondary_tool (saving a cache hit to Drive or Notion).
+# first_token is the first streamed token when streaming, the first model turn otherwise.
+_run_timings: "contextvars.ContextVar[Optional[Dict[str, float]]]" = contextvars.ContextVar("run_timings", default=None)
+
+
+def record_timing(phase: str, seconds: float, first_only: bool = False) -> None:
+    """Add seconds to a phase of the current run's timings; a no-op outside a timed run."""
+    timings = _run_timings.get()
+    if timings is None or (first_only and phase in timings):
+        return
+    timings[phase] = round(timings.get(phase, 0.0) + seconds, 4)
+
+
+@contextlib.contextmanager
+def timed_phase(phase: str) -> Iterator[None]:
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_timing(phase, time.perf_counter() - started)
+
+
+async def _with_timings(timings: Dict[str, float], coro_fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+    """Await coro_fn with timings as the current run's timings."""
+    token = _run_timings.set(timings)
+    try:
+        return await coro_fn(*args, **kwargs)
+    finally:
+        _run_timings.reset(token)
+
+
+async def _timed_cache_lookup(user_goal: str, progress_callback: Optional[Callable[[str], None]]) -> Optional[dict]:
+    with timed_phase("cache_lookup"):
+        return _cached_learning_path_result(user_goal, progress_callback)
+
+
+async def _timed_cache_store(user_goal: str, result: dict) -> None:
+    with timed_phase("cache_store"):
+        await _store_learning_path_result(user_goal, result)
+
+
+# -----------------------------
+# Usage Accounting and Budgets
+# -----------------------------
+
+# USD per million (input, output) tokens, used for the cost estimate in usage reports
+MODEL_PRICING_PER_MTOK: Dict[str, Tuple[float, float]] = {
+    "gemini-2.5-pro": (1.25, 10.0),
+    "gemini-2.5-flash": (0.30, 2.50),
+    "gemini-2.5-flash-lite": (0.10, 0.40),
+}
+
+
+def collect_usage(result: dict, wall_time_s: Optional[float] = None) -> Dict[str, Any]:
+    """
+    Per-run usage report from the usage_metadata of every AI message in an agent result:
+    input/output/total tokens, LLM turns, tool calls, wall time and an estimated cost.
+    """
+    usage: Dict[str, Any] = {
+        "input_tokens": 0,
+        "output_tokens": 0,
+        "total_tokens": 0,
+        "llm_turns": 0,
+        "tool_calls": int((result or {}).get("tool_calls_made") or 0),
+        "wall_time_s": round(wall_time_s, 3) if wall_time_s is not None else None,
+        "estimated_cost_usd": 0.0,
+    }
+    cost = 0.0
+    for msg in (result or {}).get("messages") or []:
+        msg_type = getattr(msg, "type", "")
+        if msg_type == "tool":
+            usage["tool_calls"] += 1
+            continue
+        if msg_type != "ai":
+            continue
+        usage["llm_turns"] += 1
+        meta = getattr(msg, "usage_metadata", None) or {}
+        input_tokens = int(meta.get("input_tokens") or 0)
+        output_tokens = int(meta.get("output_tokens") or 0)
+        usage["input_tokens"] += input_tokens
+        usage["output_tokens"] += output_tokens
+        usage["total_tokens"] += int(meta.get("total_tokens") or input_tokens + output_tokens)
+        model_name = (getattr(msg, "response_metadata", None) or {}).get("model_name", "")
+        price = next((p for name, p in sorted(MODEL_PRICING_PER_MTOK.items(), key=lambda kv: -len(kv[0]))
+                      if name in model_name), None)
+        if price:
+            cost += (input_tokens * price[0] + output_tokens * price[1]) / 1_000_000
+    usage["estimated_cost_usd"] = round(cost, 6)
+    return usage
+
+
+class RunBudget:
+    """
+    Limits for a single generation. Any limit left as None is not enforced.
+    The agent loop is checked between graph steps and stops cleanly once a limit is crossed.
+    """
+
+    def __init__(
+        self,
+        max_total_tokens: Optional[int] = None,
+        max_llm_turns: Optional[int] = None,
+        max_tool_calls: Optional[int] = None,
+        max_wall_time_s: Optional[float] = None
+    ):
+        self.max_total_tokens = max_total_tokens
+        self.max_llm_turns = max_llm_turns
+        self.max_tool_calls = max_tool_calls
+        self.max_wall_time_s = max_wall_time_s
+
+    def exceeded(self, usage: Dict[str, Any]) -> Optional[str]:
+        """Return a short reason when usage is over any limit, else None."""
+        checks = (
+            ("total tokens", usage.get("total_tokens"), self.max_total_tokens),
+            ("LLM turns", usage.get("llm_turns"), self.max_llm_turns),
+            ("tool calls", usage.get("tool_calls"), self.max_tool_calls),
+            ("wall time", usage.get("wall_time_s"), self.max_wall_time_s),
+        )
+        for label, used, limit in checks:
+            if limit is not None and used is not None and used > limit:
+                return f"{label} {used} > {limit}"
+        return None
+
+    def remaining_time(self, started: float) -> Optional[float]:
+        if self.max_wall_time_s is None:
+            return None
+        return max(0.0, self.max_wall_time_s - (time.perf_counter() - started))
+
+
+# -----------------------------
+# Streaming Generation
+# -----------------------------
+
+def _chunk_text(chunk: Any) -> str:
+    """Extract plain text from a streamed message chunk (string or list of content parts)."""
+    content = getattr(chunk, "content", None)
+    if isinstance(content, str):
+        return content
+    if isinstance(content, list):
+        return "".join(
+            part.get("text", "") if isinstance(part, dict) else str(part)
+            for part in content
+            if isinstance(part, (dict, str))
+        )
+    return ""
+
+
+def _partial_stream_state(ai_messages: List[Any], live_usage: Dict[str, Any], **flags: Any) -> dict:
+    """State for a stream stopped before the graph finished: the model turns seen so far."""
+    return dict({"messages": list(ai_messages), "tool_calls_made": live_usage["tool_calls"]}, **flags)
+
+
+async def astream_learning_path(
+    google_api_key: str,
+    youtube_pipedream_url: str,
+    drive_pipedream_url: Optional[str] = None,
+    notion_pipedream_url: Optional[str] = None,
+    user_goal: str = "",
+    progress_callback: Optional[Callable[[str], None]] = None,
+    use_cache: bool = True,
+    budget: Optional[RunBudget] = None
+) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Stream a learning path generation as events built on LangGraph astream_events:
+    {"type": "token", "text"}, {"type": "tool_start", "name", "input"},
+    {"type": "tool_end", "name"} and finally {"type": "done", "result"} where result
+    is the same agent state run_agent_sync returns, including its "usage" report.
+    A budget stops the stream cleanly; the done result then holds the model turns so far.
+    The stream also ends early ("early_stopped") once a complete Day 1..N plan has been emitted
+    and the model is only searching further (see _is_completed_plan_turn).
+    """
+    started = time.perf_counter()
+    # Filled here rather than through _run_timings: a generator's context is its consumer's
+    timings: Dict[str, float] = {}
+    if use_cache:
+        cached = await _with_timings(timings, _timed_cache_lookup, user_goal, progress_callback)
+        if cached is not None:
+            cached = await _with_timings(
+                timings, _save_cached_result_to_tool,
+                google_api_key, drive_pipedream_url, notion_pipedream_url, user_goal, cached, progress_callback
+            )
+            cached = dict(cached, timings=dict(timings, total=round(time.perf_counter() - started, 4)))
+            yield {"type": "token", "text": concatenate_messages(cached)}
+            yield {"type": "done", "result": cached}
+            return
+
+    setup_started = time.perf_counter()
+    agent = await _with_timings(
+        timings,
+        _setup_agent_with_healthy_tools,
+        google_api_key=google_api_key,
+        youtube_pipedream_url=youtube_pipedream_url,
+        drive_pipedream_url=drive_pipedream_url,
+        notion_pipedream_url=notion_pipedream_url,
+        progress_callback=progress_callback
+    )
+    timings["setup"] = round(time.perf_counter() - setup_started, 4)
+    loop_started = time.perf_counter()
+    if agent is None:
+        tools_unavailable = unhealthy_server_reason(youtube_pipedream_url)
+        async for event in _astream_direct_learning_path(google_api_key, user_goal, progress_callback):
+            if event["type"] == "token":
+                timings.setdefault("first_token", round(time.perf_counter() - loop_started, 4))
+            elif event["type"] == "done":
+                timings["llm_loop"] = round(time.perf_counter() - loop_started, 4)
+                # Direct results are not cached (see _generate_learning_path_uncached)
+                event["result"]["tools_unavailable"] = tools_unavailable
+                event["result"]["usage"] = collect_usage(event["result"], time.perf_counter() - started)
+                event["result"]["timings"] = dict(timings, total=round(time.perf_counter() - started, 4))
+            yield event
+        return
+    if progress_callback:
+        progress_callback("Generating your learning path...")
+
+    final_state = None
+    expected_days = normalize_goal(user_goal)[1]
+    ai_messages: List[Any] = []
+    degraded = False
+    live_usage = {"total_tokens": 0, "llm_turns": 0, "tool_calls": 0, "wall_time_s": 0.0}
+    run_input, config, thread_id = await _prepare_agent_run(agent, user_goal)
+    loop_started = time.perf_counter()
+    events = agent.astream_events(run_input, config=config, version="v2")
+    try:
+        async for event in events:
+            kind = event["event"]
+            if kind == "on_chat_model_stream":
+                text = _chunk_text(event["data"].get("chunk"))
+                if text:
+                    timings.setdefault("first_token", round(time.perf_counter() - loop_started, 4))
+                    yield {"type": "token", "text": text}
+            elif kind == "on_chat_model_end":
+                output = event["data"].get("output")
+                meta = getattr(output, "usage_metadata", None) or {}
+                live_usage["total_tokens"] += int(meta.get("total_tokens") or 0)
+                live_usage["llm_turns"] += 1
+                if output is not None:
+                    ai_messages.append(output)
+                    if _is_completed_plan_turn(output, expected_days):
+                        final_state = _partial_stream_state(ai_messages, live_usage, early_stopped=True)
+                        break
+            elif kind == "on_tool_start":
+                live_usage["tool_calls"] += 1
+                yield {"type": "tool_start", "name": event["name"], "input": event["data"].get("input")}
+            elif kind == "on_tool_end":
+                output = event["data"].get("output")
+                if _is_degraded_tool_output(_tool_output_text(getattr(output, "content", output))):
+                    degraded = True
+                yield {"type": "tool_end", "name": event["name"]}
+            elif kind == "on_chain_end" and not event.get("parent_ids"):
+                # Root graph finished: its output is the final agent state
+                final_state = event["data"].get("output")
+            if budget is not None and final_state is None:
+                live_usage["wall_time_s"] = round(time.perf_counter() - started, 3)
+                reason = budget.exceeded(live_usage)
+                if reason:
+                    final_state = _partial_stream_state(ai_messages, live_usage, budget_exceeded=reason)
+                    break
+    except (asyncio.CancelledError, GeneratorExit):
+        # Cancelled, or the consumer closed the stream: nothing will resume this run
+        await events.aclose()
+        await _discard_checkpoint(agent, thread_id)
+        raise
+    except Exception as e:
+        # Resumed through agenerate_learning_path / run_agent_sync with mode="agent"
+        if thread_id is not None:
+            raise ResumableGenerationError(thread_id, e) from e
+        raise
+    finally:
+        await events.aclose()
+
+    timings["llm_loop"] = round(time.perf_counter() - loop_started, 4)
+    if final_state is None:
+        raise RuntimeError("Agent stream ended without a final result")
+    await _discard_checkpoint(agent, thread_id)
+    _record_tool_quota_errors(final_state, youtube_pipedream_url)
+    final_state = dict(final_state, usage=collect_usage(final_state, time.perf_counter() - started))
+    if degraded:
+        final_state["degraded"] = True
+    if final_state.get("budget_exceeded"):
+        if progress_callback:
+            progress_callback(f"Stopped early: budget exceeded ({final_state['budget_exceeded']})")
+    elif use_cache and not degraded:
+        await _with_timings(timings, _timed_cache_store, user_goal, final_state)
+
+    if progress_callback:
+        progress_callback("Learning path generation complete!")
+    final_state["timings"] = dict(timings, total=round(time.perf_counter() - started, 4))
+    yield {"type": "done", "result": final_state}
+
+
+async def _astream_direct_learning_path(
+    google_api_key: str,
+    user_goal: str,
+    progress_callback: Optional[Callable[[str], None]] = None
+) -> AsyncIterator[Dict[str, Any]]:
+    """Token stream of a direct (tool-less) generation, ending with the usual done event."""
+    model = initialize_model(google_api_key, stage="direct")
+    if progress_callback:
+        progress_callback("Generating your learning path...")
+    message = None
+    async for chunk in model.astream([HumanMessage(content=build_learning_path_prompt(user_goal) + DIRECT_MODE_NOTE)]):
+        message = chunk if message is None else message + chunk
+        text = _chunk_text(chunk)
+        if text:
+            yield {"type": "token", "text": text}
+    if message is None:
+        raise RuntimeError("Direct generation returned no output")
+    if progress_callback:
+        progress_callback("Learning path generation complete!")
+    final = AIMessage(
+        content=message.content,
+        usage_metadata=getattr(message, "usage_metadata", None),
+        response_metadata=getattr(message, "response_metadata", None) or {},
+    )
+    yield {"type": "done", "result": {"messages": [final], "direct": True}}
+
+
+def stream_learning_path(
+    google_api_key: str,
+    youtube_pipedream_url: str,
+    drive_pipedream_url: Optional[str] = None,
+    notion_pipedream_url: Optional[str] = None,
+    user_goal: str = "",
+    progress_callback: Optional[Callable[[str], None]] = None,
+    use_cache: bool = True,
+    budget: Optional[RunBudget] = None,
+    heartbeat: Optional[Callable[[], None]] = None
+) -> Iterator[Dict[str, Any]]:
+    """
+    Synchronous generator over astream_learning_path events, for rendering in Streamlit.
+    heartbeat is called while waiting for the next event (see iterate_async_sync).
+    """
+    return iterate_async_sync(
+        astream_learning_path,
+        google_api_key=google_api_key,
+        youtube_pipedream_url=youtube_pipedream_url,
+        drive_pipedream_url=drive_pipedream_url,
+        notion_pipedream_url=notion_pipedream_url,
+        user_goal=user_goal,
+        progress_callback=progress_callback,
+        use_cache=use_cache,
+        budget=budget,
+        heartbeat=heartbeat,
+    )
+
+
+# -----------------------------
+# Plan-then-Fan-out Pipeline
+# -----------------------------
+
+class PlannedDay(BaseModel):
+    """One day of a learning plan."""
+    day: int = Field(description="Day number, starting at 1")
+    topic: str = Field(description="Topic covered that day")
+    search_query: str = Field(description="YouTube search query a learner would type to find a tutorial on the topic")
+
+
+class LearningPlan(BaseModel):
+    """Day-by-day topic plan for a learning goal."""
+    title: str = Field(description="Main title of the learning path")
+    days: List[PlannedDay]
+
+
+class DayQuestions(BaseModel):
+    """Practice questions for one day of a learning path."""
+    # Not length-constrained: one short or long answer should not fail the whole day
+    questions: List[str] = Field(description="Exactly 10 practice questions, without answers")
+
+
+class VideoChoice(BaseModel):
+    """The chosen video among numbered search results."""
+    index: int = Field(description="Number of the chosen candidate")
+
+
+_YOUTUBE_ID_RE = re.compile(r"(?:\"videoId\"\s*:\s*\"|watch\?v=|youtu\.be/)([A-Za-z0-9_-]{11})")
+
+
+def _find_youtube_search_tool(tools: List[Any]) -> Optional[Any]:
+    """Pick the video search tool among the YouTube MCP tools."""
+    search_tools = [t for t in tools if "search" in t.name.lower()]
+    search_tools.sort(key=lambda t: ("video" not in t.name.lower(), len(t.name)))
+    return search_tools[0] if search_tools else None
+
+
+def _search_tool_args(tool: Any, query: str) -> Dict[str, Any]:
+    properties = tool.args or {}
+    by_folded_name = {name.casefold(): name for name in properties}
+    arg_name = next((by_folded_name[n] for n in _QUERY_ARG_NAMES if n in by_folded_name), None)
+    if arg_name is None:
+        arg_name = next((n for n, spec in properties.items() if spec.get("type") == "string"), "q")
+    args: Dict[str, Any] = {arg_name: query}
+    for limit_name in ("maxResults", "max_results", "limit"):
+        if limit_name in properties:
+            args[limit_name] = 5
+            break
+    return args
+
+
+def _tool_output_text(output: Any) -> str:
+    """Flatten a tool result (string, content parts or (content, artifact) pair) to text."""
+    if isinstance(output, tuple) and output:
+        output = output[0]
+    if isinstance(output, str):
+        return output
+    if isinstance(output, list):
+        return "\n".join(
+            part.get("text", "") if isinstance(part, dict) else str(part) for part in output
+        )
+    return str(output or "")
+
+
+def _walk_json(node: Any) -> Iterator[Dict[str, Any]]:
+    if isinstance(node, dict):
+        yield node
+        for value in node.values():
+            yield from _walk_json(value)
+    elif isinstance(node, list):
+        for value in node:
+            yield from _walk_json(value)
+
+
+def extract_youtube_videos(output: Any) -> List[Dict[str, Any]]:
+    """
+    Pull videos out of a YouTube tool result: YouTube Data API search/videos JSON,
+    optionally wrapped in {"data": ...}, or plain text with watch links as a fallback.
+    Returns dicts with "id", "title", "channel", "duration" and "views" (empty when unknown).
+    """
+    text = _tool_output_text(output)
+    videos: List[Dict[str, Any]] = []
+    seen: set = set()
+    try:
+        payload = json.loads(text)
+    except Exception:
+        payload = None
+    if payload is not None:
+        for node in _walk_json(payload):
+            vid = node.get("id")
+            if isinstance(vid, dict):
+                vid = vid.get("videoId")
+            vid = vid or node.get("videoId")
+            snippet = node.get("snippet") if isinstance(node.get("snippet"), dict) else None
+            if not isinstance(vid, str) or len(vid) != 11 or (snippet is None and "title" not in node):
+                continue
+            if vid in seen:
+                continue
+            seen.add(vid)
+            snippet = snippet or node
+            details = node.get("contentDetails") or {}
+            stats = node.get("statistics") or {}
+            videos.append({
+                "id": vid,
+                "title": snippet.get("title", ""),
+                "channel": snippet.get("channelTitle", ""),
+                "duration": details.get("duration", "") if isinstance(details, dict) else "",
+                "views": stats.get("viewCount", "") if isinstance(stats, dict) else "",
+            })
+    if not videos:
+        for vid in _YOUTUBE_ID_RE.findall(text):
+            if vid not in seen:
+                seen.add(vid)
+                videos.append({"id": vid, "title": "", "channel": "", "duration": "", "views": ""})
+    return videos
+
+
+def _youtube_search_url(topic: str) -> str:
+    return f"https://www.youtube.com/results?search_query={quote_plus(topic + ' tutorial')}"
+
+
+async def _ainvoke_structured(model: Any, schema: Any, prompt: str, raw_messages: List[Any]) -> Any:
+    """Schema-constrained call that keeps the raw AI message (and its token usage) in raw_messages."""
+    out = await model.with_structured_output(schema, include_raw=True).ainvoke(prompt)
+    raw_messages.append(out["raw"])
+    if out.get("parsing_error") or out.get("parsed") is None:
+        raise ValueError(f"Model output did not match {schema.__name__}: {out.get('parsing_error')}")
+    return out["parsed"]
+
+
+class LearningPathDay(BaseModel):
+    """One day of a structured learning path."""
+    topic: str = Field(description="Topic covered that day")
+    video_url: str = Field(description="URL of the single core YouTube video selected for the topic")
+    # Not length-constrained: validate_learning_path trims and pads each day to 10 instead,
+    # so one day off by a question does not fail a 30 or 90 day plan
+    questions: List[str] = Field(description="Exactly 10 practice questions for the day, without answers")
+
+
+class LearningPath(BaseModel):
+    """Schema-constrained learning path: a title and one entry per day."""
+    title: str = Field(description="Main title of the learning path")
+    days: List[LearningPathDay]
+
+
+QUESTIONS_PER_DAY = 10
+_FILLER_QUESTIONS = (
+    "In your own words, explain the main idea of {topic}.",
+    "What problem does {topic} solve, and when would you reach for it?",
+    "Give a small example of your own that applies {topic}.",
+    "What is a common mistake when working with {topic}, and how would you avoid it?",
+    "How does {topic} build on what you learned on earlier days?",
+    "Summarize the key terms of {topic} and define each one.",
+    "Describe a real-world situation where {topic} would be useful.",
+    "What would you look up next to go deeper into {topic}?",
+    "Compare {topic} with an alternative approach. What are the trade-offs?",
+    "Write down one question about {topic} you still cannot answer, and try to answer it.",
+)
+
+
+def _fit_questions(questions: List[str], topic: str) -> List[str]:
+    """Trim a day's questions to QUESTIONS_PER_DAY, padding a short day with generic review questions."""
+    questions = questions[:QUESTIONS_PER_DAY]
+    if len(questions) < QUESTIONS_PER_DAY:
+        print(f"Day '{topic}' has {len(questions)} of {QUESTIONS_PER_DAY} questions, padding")
+        fillers = [q.format(topic=topic or "this topic") for q in _FILLER_QUESTIONS]
+        questions += [q for q in fillers if q not in questions][:QUESTIONS_PER_DAY - len(questions)]
+    return questions
+
+
+def validate_learning_path(data: Any) -> Dict[str, Any]:
+    """
+    Validate a structured learning path once and return it as plain JSON-ready data.
+    Non-URL video links become a YouTube search for the topic, and each day is trimmed or
+    padded to exactly 10 non-blank questions.
+    Raises ValueError when the data does not match the schema or has no days.
+    """
+    if isinstance(data, BaseModel):
+        data = data.model_dump()
+    try:
+        path = LearningPath.model_validate(data)
+    except Exception as e:
+        raise ValueError(f"Invalid structured learning path: {e}") from e
+    if not path.days:
+        raise ValueError("Invalid structured learning path: no days")
+    days = []
+    for day in path.days:
+        video_url = day.video_url.strip()
+        if not video_url.lower().startswith("http") or "VIDEO_ID_HERE" in video_url:
+            video_url = _youtube_search_url(day.topic) if day.topic else "https://www.youtube.com/"
+        questions = _fit_questions([q.strip() for q in day.questions if q.strip()], day.topic.strip())
+        days.append({"topic": day.topic.strip(), "video_url": video_url, "questions": questions})
+    return {"title": path.title.strip() or "Learning Path", "days": days}
+
+
+def learning_path_to_day_items(learning_path: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Day items in the same shape extract_days_and_questions returns."""
+    return [
+        {
+            "day_title": f"Day {idx}:",
+            "topic": day.get("topic", ""),
+            "video_link": day.get("video_url", ""),
+            "questions": list(day.get("questions") or []),
+        }
+        for idx, day in enumerate(learning_path.get("days") or [], start=1)
+    ]
+
+
+def attach_learning_path(result: dict, structured: Any) -> dict:
+    """
+    Return a copy of an agent result carrying the validated "learning_path" and its
+    "day_items", so downstream code reads typed data instead of re-parsing text.
+    """
+    learning_path = validate_learning_path(structured)
+    out = dict(result or {})
+    out["learning_path"] = learning_path
+    out["day_items"] = learning_path_to_day_items(learning_path)
+    out["title"] = learning_path["title"]
+    if not out.get("messages"):
+        out["messages"] = [AIMessage(content=render_learning_path_text(learning_path["title"], out["day_items"]))]
+    return out
+
+
+def render_learning_path_text(title: str, day_items: List[Dict[str, Any]]) -> str:
+    """Render day items in the prompt's sample format, so the regular parser and PDF export apply."""
+    lines = [title or "Learning Path", ""]
+    for idx, item in enumerate(day_items, start=1):
+        lines.append(f"Day {idx}:")
+        lines.append(f"Topic: {item.get('topic', '')}")
+        lines.append(f"YouTube Link: {item.get('video_link', '')}")
+        questions = item.get("questions") or []
+        if questions:
+            lines.append("Practice Questions (10):")
+            lines.extend(f"{q_i}. {q}" for q_i, q in enumerate(questions, start=1))
+        lines.append("")
+    return "\n".join(lines).strip()
+
+
+# Structured question-writing calls per day before a parse failure fails the fan-out run
+FANOUT_QUESTION_ATTEMPTS = 2
+
+
+async def agenerate_fanout_learning_path(
     google_api_key: str,
     youtube_pipedream_url: str,
-    drive_pipedream_url: Optional[str] = None,
-    notion_pipedream_url: Optional[str] = None,
-    progress_callback: Optional[Callable[[str], None]] = None
-) -> Any:
+    user_goal: str,
+    progress_callback: Optional[Callable[[str], None]] = None,
+    max_parallel: int = 10
+) -> dict:
     """
-    Set up the agent with YouTube (mandatory) and optional Drive or Notion tools.
+    Plan-then-fan-out alternative to the ReAct loop: one structured LLM call plans the days,
+    then every day's YouTube search and question writing run in parallel (at most
+    max_parallel days at once). Latency tracks the slowest day instead of the sum of all days.
+    Only the YouTube server is used; no Drive/Notion documents are created.
+    Returns an agent-shaped result carrying the structured "learning_path".
+    Planning, video selection and question writing each use their own model route.
+    Run timings: setup, tool_discovery (overlapping planning) and first_token (the plan) fall
+    within llm_loop here, unlike the agent modes.
     """
+    started = time.perf_counter()
+    planner = initialize_model(google_api_key, stage="planning")
+    selector = initialize_model(google_api_key, stage="video_selection")
+    question_writer = initialize_model(google_api_key, stage="question_writing")
+    mcp_client = MultiServerMCPClient({
+        "youtube": mcp_connection(youtube_pipedream_url)
+    })
+
+    if progress_callback:
+        progress_callback("Setting up agent with tools... ✅")
+    raw_messages: List[Any] = []
+    searches_made = 0
+    record_timing("setup", time.perf_counter() - started)
+
+    async def _discover_tools() -> List[Any]:
+        with timed_phase("tool_discovery"):
+            return await load_server_tools(mcp_client, "youtube")
+
+    # Tool discovery overlaps with planning
+    tools_task = asyncio.create_task(_discover_tools())
+
+    if progress_callback:
+        progress_callback("Generating your learning path...")
+    _, days = normalize_goal(user_goal)
+    day_rule = (
+        f"Plan exactly {days} days." if days
+        else "Choose a manageable number of days (at most 7) for a foundational path."
+    )
     try:
-        if progress_callback:
-            progress_callback("Setting up agent with tools... ✅")
-        
-       
-        tools_config = {
-            "youtube": {
-                "url": youtube_pipedream_url,
-                "transport": "streamable_http"
-            }
-        }
+        plan = await _ainvoke_structured(
+            planner,
+            LearningPlan,
+            "You are a day wise learning path planner. Plan a logical, progressive day-wise "
+            f"learning path for this goal: {user_goal}\n{day_rule} One core topic per day.",
+            raw_messages,
+        )
+    except BaseException:
+        tools_task.cancel()
+        raise
+    record_timing("first_token", time.perf_counter() - started, first_only=True)
+    planned_days = sorted(plan.days, key=lambda d: d.day)
+    try:
+        search_tool = _find_youtube_search_tool(await tools_task)
+    except Exception as e:
+        print(f"YouTube tool discovery failed: {e}")
+        search_tool = None
+    if search_tool is None:
+        print("No YouTube search tool found, falling back to search links")
 
-        
-        if drive_pipedream_url:
-            tools_config["drive"] = {
-                "url": drive_pipedream_url,
-                "transport": "streamable_http"
-            }
-            if progress_callback:
-                progress_callback("Added Google Drive integration... ✅")
+    semaphore = asyncio.Semaphore(max(1, max_parallel))
 
-        
-        if notion_pipedream_url:
-            tools_config["notion"] = {
-                "url": notion_pipedream_url,
-                "transport": "streamable_http"
-            }
-            if progress_callback:
-                progress_callback("Added Notion integration... ✅")
+    degraded = search_tool is None
 
+    async def _find_video(day: PlannedDay) -> str:
+        nonlocal searches_made, degraded
+        if search_tool is None:
+            return _youtube_search_url(day.topic)
+        searches_made += 1
+        try:
+            output = await search_tool.ainvoke(_search_tool_args(search_tool, day.search_query or day.topic))
+            videos = extract_youtube_videos(output)
+            if not videos and _is_degraded_tool_output(_tool_output_text(output)):
+                degraded = True
+                if _QUOTA_ERROR_RE.search(_tool_output_text(output)):
+                    mark_server_unhealthy(youtube_pipedream_url, "YouTube quota exhausted")
+        except Exception as e:
+            print(f"YouTube search failed for '{day.topic}': {e}")
+            degraded = True
+            videos = []
+        if not videos:
+            return _youtube_search_url(day.topic)
+        best = videos[0]
+        if len(videos) > 1:
+            try:
+                best = await _select_video(day, videos[:5])
+            except Exception as e:
+                print(f"Video selection failed for '{day.topic}', using the top result: {e}")
+        return f"https://www.youtube.com/watch?v={best['id']}"
+
+    async def _select_video(day: PlannedDay, candidates: List[Dict[str, Any]]) -> Dict[str, Any]:
+        listing = "\n".join(
+            f"{i}. {v.get('title') or '(untitled)'} | channel: {v.get('channel') or '?'}"
+            f" | duration: {v.get('duration') or '?'} | views: {v.get('views') or '?'}"
+            for i, v in enumerate(candidates)
+        )
+        choice = await _ainvoke_structured(
+            selector,
+            VideoChoice,
+            f"Learning goal: {user_goal}\nDay {day.day} topic: {day.topic}\n"
+            "Pick the single most suitable core video for this day: foundational, a clear overview, "
+            f"and on topic.\nCandidates:\n{listing}",
+            raw_messages,
+        )
+        return candidates[choice.index] if 0 <= choice.index < len(candidates) else candidates[0]
+
+    async def _write_questions(day: PlannedDay) -> List[str]:
+        # One more attempt when the answer does not parse or is short; a second parse failure
+        # fails the run, a second short answer is padded by validate_learning_path
+        for attempt in range(1, FANOUT_QUESTION_ATTEMPTS + 1):
+            try:
+                answer = await _ainvoke_structured(
+                    question_writer,
+                    DayQuestions,
+                    f"Learning goal: {user_goal}\nDay {day.day} topic: {day.topic}\n"
+                    "Write exactly 10 diverse, progressively challenging practice questions that directly "
+                    "assess this day's concepts. Mix conceptual, practical and brief coding/thinking prompts "
+                    "as appropriate. Do not include answers.",
+                    raw_messages,
+                )
+                questions = [q.strip() for q in answer.questions if q.strip()]
+                if len(questions) < QUESTIONS_PER_DAY and attempt < FANOUT_QUESTION_ATTEMPTS:
+                    raise ValueError(f"only {len(questions)} non-blank questions")
+            except ValueError as e:
+                if attempt == FANOUT_QUESTION_ATTEMPTS:
+                    raise
+                print(f"Question writing failed for '{day.topic}', retrying: {e}")
+                continue
+            return questions
+
+    async def _build_day(day: PlannedDay) -> Dict[str, Any]:
+        async with semaphore:
+            video_link, questions = await asyncio.gather(_find_video(day), _write_questions(day))
         if progress_callback:
-            progress_callback("Initializing MCP client... ✅")
-        
-        mcp_client = MultiServerMCPClient(tools_config)
-        
-        if progress_callback:
-            progress_callback("Getting available tools... ✅")
-        
-        tools = await mcp_client.get_tools()
-        
-        if progress_callback:
-            progress_callback("Creating AI agent... ✅")
-        
-        mcp_orch_model = initialize_model(google_api_key)
-        agent = create_react_agent(mcp_orch_model, tools)
-        
-        if progress_callback:
-            progress_callback("Setup complete! Starting to generate learning path... ✅")
-        
-        return agent
-    except Exception as e:
-        print(f"Error in setup_agent_with_tools: {str(e)}")
+            progress_callback(f"Day {day.day} ready: {day.topic}")
+        return {"topic": day.topic, "video_url": video_link, "questions": questions}
+
+    day_tasks = [asyncio.create_task(_build_day(d)) for d in planned_days]
+    try:
+        days_out = list(await asyncio.gather(*day_tasks))
+    except BaseException:
+        # gather does not cancel the other days when one fails; stop them spending tokens
+        for task in day_tasks:
+            task.cancel()
         raise
+    learning_path = {"title": plan.title, "days": days_out}
+    result = attach_learning_path({"messages": raw_messages, "tool_calls_made": searches_made}, learning_path)
+    if degraded:
+        # Some days got a search link instead of a picked video
+        result["degraded"] = True
+    return result
 
-def run_agent_sync(
+
+# -----------------------------
+# Batch Generation
+# -----------------------------
+
+async def agenerate_learning_paths_batch(
     google_api_key: str,
     youtube_pipedream_url: str,
+    user_goals: List[str],
     drive_pipedream_url: Optional[str] = None,
     notion_pipedream_url: Optional[str] = None,
-    user_goal: str = "",
-    progress_callback: Optional[Callable[[str], None]] = None
-) -> dict:
+    concurrency: int = 8,
+    progress_callback: Optional[Callable[[str], None]] = None,
+    use_cache: bool = True,
+    budget: Optional[RunBudget] = None
+) -> AsyncIterator[Dict[str, Any]]:
     """
-    Synchronous wrapper for running the agent.
+    Generate learning paths for many goals with at most `concurrency` runs in flight,
+    sharing the pooled agent. Each goal runs like an agent-mode agenerate_learning_path call
+    (health checks, direct fallback, quota accounting, cache rules) without coalescing.
+    Yields {"index", "goal", "result", "error"} per goal in completion order; a failed goal
+    carries its error message and does not stop the batch.
     """
-    async def _run():
-        try:
-            agent = await setup_agent_with_tools(
-                google_api_key=google_api_key,
-                youtube_pipedream_url=youtube_pipedream_url,
-                drive_pipedream_url=drive_pipedream_url,
-                notion_pipedream_url=notion_pipedream_url,
-                progress_callback=progress_callback
-            )
-            
-            
-            learning_path_prompt = "User Goal: " + user_goal + "\n" + user_goal_prompt
-            
-            if progress_callback:
-                progress_callback("Generating your learning path...")
-            
-            result = await agent.ainvoke(
-                {"messages": [HumanMessage(content=learning_path_prompt)]},
-                config=cfg
-            )
-            
-            if progress_callback:
-                progress_callback("Learning path generation complete!")
-            
-            return result
-        except Exception as e:
-            print(f"Error in _run: {str(e)}")
-            raise
+    # Warm the agent (or find YouTube unhealthy) once before the goals fan out
+    await _setup_agent_with_healthy_tools(
+        google_api_key=google_api_key,
+        youtube_pipedream_url=youtube_pipedream_url,
+        drive_pipedream_url=drive_pipedream_url,
+        notion_pipedream_url=notion_pipedream_url,
+        progress_callback=progress_callback
+    )
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+    total = len(user_goals)
+    finished = 0
 
-    
-    loop = asyncio.new_event_loop()
-    asyncio.set_event_loop(loop)
+    async def _generate_one(index: int, goal: str) -> Dict[str, Any]:
+        async with semaphore:
+            try:
+                result = _cached_learning_path_result(goal) if use_cache else None
+                if result is not None:
+                    result = await _save_cached_result_to_tool(
+                        google_api_key, drive_pipedream_url, notion_pipedream_url, goal, result
+                    )
+                else:
+                    result = await _generate_learning_path_uncached(
+                        google_api_key=google_api_key,
+                        youtube_pipedream_url=youtube_pipedream_url,
+                        drive_pipedream_url=drive_pipedream_url,
+                        notion_pipedream_url=notion_pipedream_url,
+                        user_goal=goal,
+                        progress_callback=None,
+                        use_cache=use_cache,
+                        mode="agent",
+                        budget=budget,
+                        started=time.perf_counter()
+                    )
+                return {"index": index, "goal": goal, "result": result, "error": None}
+            except Exception as e:
+                print(f"Error generating batch goal #{index}: {str(e)}")
+                return {"index": index, "goal": goal, "result": None, "error": str(e) or type(e).__name__}
+
+    tasks = [asyncio.create_task(_generate_one(i, goal)) for i, goal in enumerate(user_goals)]
     try:
-        return loop.run_until_complete(_run())
+        for next_done in asyncio.as_completed(tasks):
+            item = await next_done
+            finished += 1
+            if progress_callback:
+                progress_callback(f"Batch progress: {finished}/{total} goals done")
+            yield item
     finally:
-        loop.close()
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+
+
+def generate_learning_paths_batch(
+    google_api_key: str,
+    youtube_pipedream_url: str,
+    user_goals: List[str],
+    drive_pipedream_url: Optional[str] = None,
+    notion_pipedream_url: Optional[str] = None,
+    concurrency: int = 8,
+    progress_callback: Optional[Callable[[str], None]] = None,
+    use_cache: bool = True,
+    budget: Optional[RunBudget] = None
+) -> Iterator[Dict[str, Any]]:
+    """
+    Synchronous generator over agenerate_learning_paths_batch results.
+    """
+    return iterate_async_sync(
+        agenerate_learning_paths_batch,
+        google_api_key=google_api_key,
+        youtube_pipedream_url=youtube_pipedream_url,
+        user_goals=user_goals,
+        drive_pipedream_url=drive_pipedream_url,
+        notion_pipedream_url=notion_pipedream_url,
+        concurrency=concurrency,
+        progress_callback=progress_callback,
+        use_cache=use_cache,
+        budget=budget,
+    )
 
 
 # -----------------------------
@@ -149,6 +2906,9 @@ def concatenate_messages(agent_result: dict) -> str:
     """
     if not agent_result:
         return ""
+    learning_path = agent_result.get("learning_path")
+    if learning_path:
+        return render_learning_path_text(learning_path.get("title", ""), learning_path_to_day_items(learning_path))
     messages = agent_result.get("messages") or []
     parts: List[str] = []
     for msg in messages:
@@ -183,6 +2943,9 @@ def sanitize_learning_path_text(text: str) -> str:
         if s.startswith("{") and s.endswith("}"):
             # likely tool json
             continue
+        if s.startswith("[{") and s.endswith("}]"):
+            # compacted tool json
+            continue
         lines.append(ln)
     cleaned = "\n".join(lines).strip()
 
@@ -198,24 +2961,35 @@ def sanitize_learning_path_text(text: str) -> str:
     return cleaned
 
 
-def extract_days_and_questions(text: str) -> List[Dict[str, Any]]:
+def split_day_sections(text: str) -> List[str]:
     """
-    Parse the generated learning path text and extract per-day sections with optional
-    practice questions. This uses forgiving regex to handle typical formats.
-    Returns a list of dicts: {"day_title", "topic", "video_link", "questions": [..]}.
+    Split learning path text into its 'Day N:' / 'Day N -' blocks, header included.
     """
     if not text:
         return []
-
     # Ensure each Day starts on its own line to simplify splitting
     canon = re.sub(r"\s+(Day\s+\d+\s*[:\-])", r"\n\1", text, flags=re.IGNORECASE)
     # Split by Day headers like 'Day 1:' or 'Day 1 -'
     day_blocks = re.split(r"\n(?=\s*Day\s+\d+\s*[:\-])", canon, flags=re.IGNORECASE)
-    results: List[Dict[str, Any]] = []
+    sections: List[str] = []
     for block in day_blocks:
         block = block.strip()
-        if not block or not re.match(r"^Day\s+\d+\s*[:\-]", block, flags=re.IGNORECASE):
-            continue
+        if block and re.match(r"^Day\s+\d+\s*[:\-]", block, flags=re.IGNORECASE):
+            sections.append(block)
+    return sections
+
+
+def extract_days_and_questions(text: str) -> List[Dict[str, Any]]:
+    """
+    Parse the generated learning path text and extract per-day sections with optional
+    practice questions. This uses forgiving regex to handle typical formats.
+    Returns a list of dicts: {"day_title", "topic", "video_link", "questions": [..]}.
+    """
+    if not text:
+        return []
+
+    results: List[Dict[str, Any]] = []
+    for block in split_day_sections(text):
         title_match = re.match(r"^(Day\s+\d+\s*[:\-]\s*)(.*)$", block, flags=re.IGNORECASE)
         day_title = title_match.group(1).strip() if title_match else "Day"
         rest = title_match.group(2).strip() if title_match else block
@@ -326,6 +3100,33 @@ def extract_days_and_questions(text: str) -> List[Dict[str, Any]]:
     return fallback
 
 
+def is_learning_path_complete(text: str, expected_days: Optional[int] = None) -> bool:
+    """
+    True once every planned day has a topic, a video link and 10 practice questions.
+    Without expected_days, days 1..N up to the highest day present are taken as the plan.
+    """
+    sections = split_day_sections(sanitize_learning_path_text(text))
+    if not sections or (expected_days and len(sections) < expected_days):
+        return False
+    day_numbers = set()
+    for block in sections:
+        day_numbers.add(int(re.match(r"^Day\s+(\d+)", block, flags=re.IGNORECASE).group(1)))
+        if not re.search(r"Topic\s*:\s*\S", block, flags=re.IGNORECASE):
+            return False
+        if not re.search(r"https?://\S+", block):
+            return False
+        q_match = re.search(
+            r"Practice\s*Questions\s*\(\s*10\s*\)\s*:?\s*(.*)$", block, flags=re.IGNORECASE | re.DOTALL
+        )
+        if not q_match:
+            return False
+        questions = [ln for ln in q_match.group(1).splitlines() if re.sub(r"^\d+\.?\s*", "", ln.strip(" -\t"))]
+        if len(questions) < 10:
+            return False
+    last_day = expected_days or max(day_numbers)
+    return all(day in day_numbers for day in range(1, last_day + 1))
+
+
 # -----------------------------
 # Progress Tracking
 # -----------------------------
@@ -360,6 +3161,7 @@ def save_progress(user_goal: str, progress: Dict[str, Any]) -> None:
 
 DATA_DIR = os.path.join(os.path.dirname(__file__), "data")
 HISTORY_PATH = os.path.join(DATA_DIR, "history.json")
+CHECKPOINT_PATH = os.path.join(DATA_DIR, "checkpoints.sqlite")
 
 
 def _ensure_data_dir() -> None:
@@ -386,6 +3188,352 @@ def save_history_record(record: Dict[str, Any]) -> None:
         json.dump(history, f, ensure_ascii=False, indent=2)
 
 
+# -----------------------------
+# Learning Path Response Cache
+# -----------------------------
+
+_DAY_COUNT_RE = re.compile(
+    r"\b(?:in|within|over|for)?\s*(\d+)\s*-?\s*(days?|weeks?)\b", flags=re.IGNORECASE
+)
+
+
+def normalize_goal(user_goal: str) -> Tuple[str, Optional[int]]:
+    """
+    Case-fold and whitespace-collapse a goal and pull out its day count.
+    "Learn  Python basics in 3 Days!" -> ("learn python basics", 3).
+    """
+    text = " ".join((user_goal or "").casefold().split())
+    days: Optional[int] = None
+    m = _DAY_COUNT_RE.search(text)
+    if m:
+        days = int(m.group(1)) * (7 if m.group(2).startswith("week") else 1)
+        text = (text[:m.start()] + " " + text[m.end():])
+    text = " ".join(re.sub(r"[^\w\s+#.-]", " ", text).split()).strip(" .-")
+    return text, days
+
+
+def goal_cache_key(user_goal: str) -> str:
+    text, days = normalize_goal(user_goal)
+    return f"{text}|{days if days is not None else ''}"
+
+
+# Words that carry no topic signal, and near-synonyms folded together before shingling
+_GOAL_STOPWORDS = {
+    "i", "want", "wanna", "would", "like", "to", "learn", "learning", "study", "master",
+    "the", "a", "an", "of", "and", "in", "on", "for", "with", "my", "me", "how", "about",
+    "please", "course", "path", "plan", "tutorial", "tutorials", "guide", "programming",
+}
+_GOAL_SYNONYMS = {
+    "basic": "basics", "fundamentals": "basics", "fundamental": "basics", "beginner": "basics",
+    "beginners": "basics", "intro": "basics", "introduction": "basics", "essentials": "basics",
+    "advance": "advanced", "py": "python", "js": "javascript", "ml": "machine learning",
+    "ds": "data science",
+}
+
+
+# Share of topic words two goals must have in common (Jaccard) to count as near-duplicates
+SIMILAR_GOAL_MIN_WORD_OVERLAP = 0.6
+
+
+def _stem(word: str) -> str:
+    """Fold simple plurals: "decorators" -> "decorator", "libraries" -> "library"."""
+    if len(word) > 4 and word.endswith("ies"):
+        return word[:-3] + "y"
+    if len(word) > 3 and word.endswith("s") and not word.endswith(("ss", "us", "is")):
+        return word[:-1]
+    return word
+
+
+def _similarity_text(normalized_goal: str) -> str:
+    words = " ".join(_GOAL_SYNONYMS.get(w, w) for w in normalized_goal.split()).split()
+    return " ".join(_stem(w) for w in words if w not in _GOAL_STOPWORDS)
+
+
+def _topic_words_overlap(words: frozenset, other: frozenset) -> bool:
+    """
+    Topic words are close enough for a near-duplicate: enough of them shared, and the same
+    numbers ("python 2" is not "python 3"). One differing word out of two ("c basics" /
+    "r basics") stays below the overlap threshold.
+    """
+    if {w for w in words if w.isdigit()} != {w for w in other if w.isdigit()}:
+        return False
+    union = words | other
+    return not union or len(words & other) / len(union) >= SIMILAR_GOAL_MIN_WORD_OVERLAP
+
+
+class GoalSimilarityIndex:
+    """
+    MinHash/LSH index over character n-grams of normalized goals, partitioned by day count.
+    Queries touch only the LSH buckets of the same day count and verify a handful of the
+    best candidates with exact Jaccard similarity, so lookups stay sub-millisecond.
+    A match must also share most of its topic words (see _topic_words_overlap), so goals
+    that differ by one short word ("c basics" / "r basics") never match.
+    """
+
+    _PRIME = (1 << 61) - 1
+
+    def __init__(self, num_perm: int = 32, bands: int = 8, ngram: int = 3, max_candidates: int = 8, seed: int = 7):
+        if num_perm % bands:
+            raise ValueError("num_perm must be divisible by bands")
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.ngram = ngram
+        self.max_candidates = max_candidates
+        rng = random.Random(seed)
+        self._perms = [(rng.randrange(1, self._PRIME), rng.randrange(0, self._PRIME)) for _ in range(num_perm)]
+        self._buckets: Dict[Tuple[Optional[int], int, Tuple[int, ...]], set] = {}
+        self._entries: Dict[str, Tuple[frozenset, List[Tuple[int, ...]], Optional[int], frozenset]] = {}
+        self._lock = threading.Lock()
+
+    def _shingles(self, text: str) -> frozenset:
+        padded = f" {text} "
+        if len(padded) <= self.ngram:
+            return frozenset([zlib.crc32(padded.encode("utf-8"))])
+        return frozenset(
+            zlib.crc32(padded[i:i + self.ngram].encode("utf-8"))
+            for i in range(len(padded) - self.ngram + 1)
+        )
+
+    def _band_keys(self, shingles: frozenset) -> List[Tuple[int, ...]]:
+        p = self._PRIME
+        signature = [min((a * x + b) % p for x in shingles) for a, b in self._perms]
+        return [tuple(signature[i * self.rows:(i + 1) * self.rows]) for i in range(self.bands)]
+
+    def add(self, key: str, normalized_goal: str, days: Optional[int]) -> None:
+        text = _similarity_text(normalized_goal)
+        shingles = self._shingles(text)
+        bands = self._band_keys(shingles)
+        with self._lock:
+            self._remove_locked(key)
+            self._entries[key] = (shingles, bands, days, frozenset(text.split()))
+            for i, band in enumerate(bands):
+                self._buckets.setdefault((days, i, band), set()).add(key)
+
+    def _remove_locked(self, key: str) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        _, bands, days, _ = entry
+        for i, band in enumerate(bands):
+            bucket = self._buckets.get((days, i, band))
+            if bucket is not None:
+                bucket.discard(key)
+                if not bucket:
+                    del self._buckets[(days, i, band)]
+
+    def remove(self, key: str) -> None:
+        with self._lock:
+            self._remove_locked(key)
+
+    def query(self, normalized_goal: str, days: Optional[int], threshold: float) -> Optional[Tuple[str, float]]:
+        """
+        Return (key, jaccard) of the most similar goal with the same day count and overlapping
+        topic words, if above threshold.
+        """
+        text = _similarity_text(normalized_goal)
+        shingles = self._shingles(text)
+        words = frozenset(text.split())
+        bands = self._band_keys(shingles)
+        with self._lock:
+            hits: Dict[str, int] = {}
+            for i, band in enumerate(bands):
+                for key in self._buckets.get((days, i, band), ()):
+                    hits[key] = hits.get(key, 0) + 1
+            best: Optional[Tuple[str, float]] = None
+            for key in sorted(hits, key=hits.get, reverse=True)[:self.max_candidates]:
+                other, _, _, other_words = self._entries[key]
+                if not _topic_words_overlap(words, other_words):
+                    continue
+                score = len(shingles & other) / len(shingles | other)
+                if score >= threshold and (best is None or score > best[1]):
+                    best = (key, score)
+            return best
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class LearningPathCache:
+    """
+    Sanitized learning paths and their parsed day items, keyed by normalized goal.
+    Entries expire ttl seconds after creation, the least recently used are evicted
+    beyond max_size, and the cache is persisted to a JSON Lines file so it survives restarts:
+    every put appends one record (later records win on load), and the file is compacted
+    to the live entries once it holds more than twice max_size records.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        max_size: int = 1000,
+        ttl: Optional[float] = 7 * 24 * 3600,
+        similarity_threshold: Optional[float] = 0.75
+    ):
+        self.path = path
+        self.max_size = max_size
+        self.similarity_threshold = similarity_threshold
+        self._entries = TTLCache(max_size=max_size, ttl=ttl, refresh_on_access=False)
+        self._index = GoalSimilarityIndex()
+        self._loaded = False
+        # Records in the file, live or superseded; drives compaction
+        self._file_records = 0
+        # Guards loading and the file; puts append under it so the file order matches set order
+        self._lock = threading.Lock()
+
+    def _load(self) -> None:
+        with self._lock:
+            if self._loaded:
+                return
+            self._loaded = True
+            if not os.path.isfile(self.path):
+                return
+            try:
+                with open(self.path, "r", encoding="utf-8") as f:
+                    for line in f:
+                        try:
+                            rec = json.loads(line)
+                        except ValueError:
+                            continue  # A torn last line from an interrupted append
+                        self._file_records += 1
+                        if isinstance(rec, dict) and rec.get("key"):
+                            self._entries.set(rec["key"], rec.get("entry") or {}, stamp=rec.get("stamp"))
+            except Exception:
+                return
+            for key, _, _ in self._entries.items():
+                self._index_key(key)
+
+    def _index_key(self, key: str) -> None:
+        text, _, days = key.rpartition("|")
+        self._index.add(key, text, int(days) if days else None)
+
+    def _append_locked(self, record: Dict[str, Any]) -> None:
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            self._file_records += 1
+        except Exception as e:
+            print(f"Could not persist response cache: {e}")
+
+    def _compact_locked(self) -> None:
+        """Rewrite the file with only the live entries (snapshot and write under the same lock)."""
+        records = [{"key": k, "entry": v, "stamp": st} for k, v, st in self._entries.items()]
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                for record in records:
+                    f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            os.replace(tmp_path, self.path)
+            self._file_records = len(records)
+        except Exception as e:
+            print(f"Could not persist response cache: {e}")
+
+    def get(self, user_goal: str, allow_similar: bool = True) -> Optional[Dict[str, Any]]:
+        """
+        Exact normalized-goal lookup, then (with allow_similar) the closest previously generated
+        goal with the same day count. Similar hits carry "similar_to" and "similarity".
+        """
+        self._load()
+        entry = self._entries.get(goal_cache_key(user_goal))
+        if entry is not None or not allow_similar or self.similarity_threshold is None:
+            return entry
+        text, days = normalize_goal(user_goal)
+        match = self._index.query(text, days, self.similarity_threshold)
+        if match is None:
+            return None
+        key, score = match
+        entry = self._entries.get(key)
+        if entry is None:
+            # Expired or evicted since it was indexed
+            self._index.remove(key)
+            return None
+        return dict(entry, similar_to=entry.get("goal", ""), similarity=round(score, 3))
+
+    def put(
+        self,
+        user_goal: str,
+        text: str,
+        day_items: List[Dict[str, Any]],
+        learning_path: Optional[Dict[str, Any]] = None
+    ) -> None:
+        self._load()
+        key = goal_cache_key(user_goal)
+        self._index_key(key)
+        if len(self._index) > 2 * self.max_size:
+            self._rebuild_index()
+        entry = {
+            "goal": user_goal,
+            "text": text,
+            "day_items": day_items,
+            "learning_path": learning_path,
+            "created_at": datetime.now().isoformat(timespec="seconds"),
+        }
+        stamp = time.time()
+        with self._lock:
+            self._entries.set(key, entry, stamp=stamp)
+            self._append_locked({"key": key, "entry": entry, "stamp": stamp})
+            if self._file_records > 2 * self.max_size:
+                self._compact_locked()
+
+    def _rebuild_index(self) -> None:
+        self._index = GoalSimilarityIndex()
+        for key, _, _ in self._entries.items():
+            self._index_key(key)
+
+    def clear(self) -> None:
+        self._load()
+        with self._lock:
+            self._entries.clear()
+            self._index = GoalSimilarityIndex()
+            self._compact_locked()
+
+
+response_cache = LearningPathCache(os.path.join(DATA_DIR, "response_cache.jsonl"))
+
+
+def _cached_learning_path_result(
+    user_goal: str,
+    progress_callback: Optional[Callable[[str], None]] = None,
+    require_structure: bool = False
+) -> Optional[dict]:
+    """
+    Return a cache hit shaped like an agent result, or None. With require_structure (structured
+    and fan-out requests), text-only entries are misses; the new structured result replaces them.
+    """
+    entry = response_cache.get(user_goal)
+    if not entry or (require_structure and not entry.get("learning_path")):
+        return None
+    if progress_callback:
+        if entry.get("similar_to"):
+            progress_callback(f"Found a cached learning path for a similar goal: '{entry['similar_to']}'... ✅")
+        else:
+            progress_callback("Found a cached learning path for this goal... ✅")
+        progress_callback("Learning path generation complete!")
+    result = {
+        "messages": [AIMessage(content=entry["text"])],
+        "day_items": entry.get("day_items") or [],
+        "cached": True,
+        "usage": collect_usage({}, 0.0),
+    }
+    if entry.get("learning_path"):
+        result["learning_path"] = entry["learning_path"]
+    if entry.get("similar_to"):
+        result["similar_to"] = entry["similar_to"]
+        result["similarity"] = entry.get("similarity")
+    return result
+
+
+async def _store_learning_path_result(user_goal: str, result: dict) -> None:
+    text = sanitize_learning_path_text(concatenate_messages(result))
+    if text:
+        day_items = result.get("day_items") or extract_days_and_questions(text)
+        # The cache file write is blocking, keep it off the event loop
+        await asyncio.to_thread(
+            response_cache.put, user_goal, text, day_items, result.get("learning_path")
+        )
+
+
 # -----------------------------
 # PDF Export
 # -----------------------------
@@ -426,25 +3574,90 @@ def export_to_pdf(title: str, content: str, output_dir: str) -> Tuple[bool, str]
 # Drive Upload via MCP Agent
 # -----------------------------
 
-async def _create_drive_agent(google_api_key: str, drive_pipedream_url: str, progress_callback: Optional[Callable[[str], None]] = None):
+_TOOL_LABELS = {"drive": "Drive", "notion": "Notion"}
+
+
+async def _create_tool_agent(
+    google_api_key: str,
+    server_name: str,
+    server_url: str,
+    progress_callback: Optional[Callable[[str], None]] = None
+):
+    """Pooled single-server ("drive" or "notion") agent on the upload model route."""
+    label = _TOOL_LABELS[server_name]
+    # YouTube slot is None: generation agents always carry a YouTube URL, so keys never collide
+    pool_key = AgentPool.make_key(
+        google_api_key, None,
+        server_url if server_name == "drive" else None,
+        server_url if server_name == "notion" else None
+    )
+    agent = agent_pool.get(pool_key)
+    if agent is not None:
+        if progress_callback:
+            progress_callback(f"Reusing warm {label} agent from pool... ✅")
+        return agent
     if progress_callback:
-        progress_callback("Initializing Drive MCP client... ✅")
+        progress_callback(f"Initializing {label} MCP client... ✅")
     tools_config = {
-        "drive": {
-            "url": drive_pipedream_url,
-            "transport": "streamable_http",
-        }
+        server_name: mcp_connection(server_url)
     }
     mcp_client = MultiServerMCPClient(tools_config)
-    tools = await mcp_client.get_tools()
+    tools = await load_all_tools(mcp_client)
     if progress_callback:
-        progress_callback("Creating Drive-only agent... ✅")
-    model = initialize_model(google_api_key)
+        progress_callback(f"Creating {label}-only agent... ✅")
+    model = initialize_model(google_api_key, stage="upload")
     agent = create_react_agent(model, tools)
+    agent_pool.put(pool_key, agent)
     return agent
 
 
-def upload_pdf_to_drive_via_agent(
+async def _create_drive_agent(google_api_key: str, drive_pipedream_url: str, progress_callback: Optional[Callable[[str], None]] = None):
+    return await _create_tool_agent(google_api_key, "drive", drive_pipedream_url, progress_callback)
+
+
+async def _save_cached_result_to_tool(
+    google_api_key: str,
+    drive_pipedream_url: Optional[str],
+    notion_pipedream_url: Optional[str],
+    user_goal: str,
+    result: dict,
+    progress_callback: Optional[Callable[[str], None]] = None
+) -> dict:
+    """
+    On a response-cache hit, create the Drive document or Notion page a generation would have
+    created, from the cached text. Best effort: the outcome is reported in result["saved_to"]
+    ({"tool", "ok", "info"}) and never fails the request.
+    """
+    server_name, server_url = ("drive", drive_pipedream_url) if drive_pipedream_url else ("notion", notion_pipedream_url)
+    if not server_url:
+        return result
+    label = _TOOL_LABELS[server_name]
+    if not is_server_healthy(server_url):
+        return dict(result, saved_to={"tool": server_name, "ok": False, "info": f"{label} is unavailable"})
+    text = concatenate_messages(result)
+    target = "Google Drive document" if server_name == "drive" else "Notion page"
+    prompt = (
+        f"Task: Create a new {target} titled \"Learning Path: {user_goal}\" using your {label} tool, "
+        "with exactly the content below.\n\n"
+        f"{text}\n\n"
+        "Return ONLY a short confirmation line with the created id and a link if available."
+    )
+    try:
+        with timed_phase("secondary_tool"):
+            agent = await _create_tool_agent(google_api_key, server_name, server_url, progress_callback)
+            if progress_callback:
+                progress_callback(f"Saving the cached learning path to {label}... ✅")
+            out = await agent.ainvoke({"messages": [HumanMessage(content=prompt)]}, config=cfg)
+        messages = out.get("messages") if isinstance(out, dict) else None
+        info = _chunk_text(messages[-1]).strip() if messages else ""
+        saved = {"tool": server_name, "ok": True, "info": info or f"Saved to {label}."}
+    except Exception as e:
+        print(f"Saving cached learning path to {label} failed: {e}")
+        saved = {"tool": server_name, "ok": False, "info": f"{label} save failed: {e}"}
+    return dict(result, saved_to=saved)
+
+
+async def aupload_pdf_to_drive(
     google_api_key: str,
     drive_pipedream_url: str,
     pdf_path: str,
@@ -458,40 +3671,54 @@ def upload_pdf_to_drive_via_agent(
         return False, f"File not found: {pdf_path}"
 
     file_name = os.path.basename(pdf_path)
-    try:
+
+    def _read_b64() -> str:
         with open(pdf_path, "rb") as f:
-            b64 = base64.b64encode(f.read()).decode("utf-8")
+            return base64.b64encode(f.read()).decode("utf-8")
+
+    try:
+        b64 = await asyncio.to_thread(_read_b64)
     except Exception as e:
         return False, f"Failed to read PDF: {e}"
 
-    async def _run():
-        try:
-            agent = await _create_drive_agent(google_api_key, drive_pipedream_url, progress_callback)
-            if progress_callback:
-                progress_callback("Uploading PDF to Drive via MCP... ✅")
-            prompt = (
-                "Task: Upload the provided PDF to Google Drive using your Drive tool.\n"
-                f"Desired filename: {file_name}\n"
-                "MIME type: application/pdf\n"
-                "Content (base64, no data URL):\n"
-                f"{b64}\n\n"
-                "Return ONLY a short confirmation line with the created file id and a view link if available."
-            )
-            result = await agent.ainvoke({"messages": [HumanMessage(content=prompt)]}, config=cfg)
-            # Extract concise message content
-            msg_list = result.get("messages") if isinstance(result, dict) else None
-            if msg_list:
-                for m in msg_list:
-                    content = getattr(m, "content", None)
-                    if isinstance(content, str) and content.strip():
-                        return True, content.strip()
-            return True, "Uploaded to Drive (details not available)."
-        except Exception as e:
-            return False, f"Drive upload failed: {e}"
-
-    loop = asyncio.new_event_loop()
-    asyncio.set_event_loop(loop)
     try:
-        return loop.run_until_complete(_run())
-    finally:
-        loop.close()
+        agent = await _create_drive_agent(google_api_key, drive_pipedream_url, progress_callback)
+        if progress_callback:
+            progress_callback("Uploading PDF to Drive via MCP... ✅")
+        prompt = (
+            "Task: Upload the provided PDF to Google Drive using your Drive tool.\n"
+            f"Desired filename: {file_name}\n"
+            "MIME type: application/pdf\n"
+            "Content (base64, no data URL):\n"
+            f"{b64}\n\n"
+            "Return ONLY a short confirmation line with the created file id and a view link if available."
+        )
+        result = await agent.ainvoke({"messages": [HumanMessage(content=prompt)]}, config=cfg)
+        # Extract concise message content
+        msg_list = result.get("messages") if isinstance(result, dict) else None
+        if msg_list:
+            for m in msg_list:
+                content = getattr(m, "content", None)
+                if isinstance(content, str) and content.strip():
+                    return True, content.strip()
+        return True, "Uploaded to Drive (details not available)."
+    except Exception as e:
+        return False, f"Drive upload failed: {e}"
+
+
+def upload_pdf_to_drive_via_agent(
+    google_api_key: str,
+    drive_pipedream_url: str,
+    pdf_path: str,
+    progress_callback: Optional[Callable[[str], None]] = None
+) -> Tuple[bool, str]:
+    """
+    Synchronous wrapper around aupload_pdf_to_drive.
+    """
+    return run_coroutine_sync(
+        aupload_pdf_to_drive,
+        google_api_key=google_api_key,
+        drive_pipedream_url=drive_pipedream_url,
+        pdf_path=pdf_path,
+        progress_callback=progress_callback,
+    )